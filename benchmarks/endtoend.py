@@ -0,0 +1,461 @@
+# Measures how fast whole items go through, against a local server that stands in for Google, whois, social media, company websites and Clearbit.
+# Nothing goes to the internet, so runs can be compared before and after a change.
+#
+# Run it from anywhere: python3 benchmarks/endtoend.py
+# Optional parameters: --items 100 --concurrentItems 0 --latency 50 --errorRate 0.02 --captchaRate 0 --serpKilobytes 100 --modes find,main
+#
+# The local server acts as the only proxy. Each mode runs in its own process, in its own temporary folder, so peak memory use is only that mode's.
+# "find" calls DomainFinder.find (or findAsync when --concurrentItems is more than 0) for each item.
+# "main" runs the whole script with the queue, database and output file.
+
+import sys
+import os
+import re
+import csv
+import json
+import time
+import random
+import shutil
+import tempfile
+import threading
+import subprocess
+import http.server
+from urllib.parse import urlparse, parse_qs
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, root)
+
+import other.helpers as helpers
+
+words = [
+    'amber', 'birch', 'cedar', 'delta', 'ember', 'falcon', 'granite', 'harbour', 'indigo', 'juniper',
+    'kestrel', 'lantern', 'meadow', 'nimbus', 'orchid', 'pebble', 'quartz', 'raven', 'summit', 'thistle',
+    'umber', 'velvet', 'willow', 'xenon', 'yarrow', 'zephyr', 'anchor', 'beacon', 'copper', 'dune'
+]
+
+socialDomains = ['facebook.com', 'instagram.com', 'twitter.com']
+
+class Company:
+    def __init__(self, number):
+        first = words[number % len(words)]
+        second = words[(number // len(words)) % len(words)]
+        third = words[(number // len(words) // len(words)) % len(words)]
+
+        self.number = f'{number:08d}'
+        self.words = f'{first} {second} {third}'
+        self.name = f'{self.words} limited'.upper()
+        # not close enough to the name on its own, so the detailed checks are needed
+        self.slug = f'{first}-{second[0:2]}{third[0:2]}'
+        self.domain = f'{self.slug}.com'
+        self.address = f'{number % 200 + 1} High Street, Newtown, England, AB{number % 9 + 1} {number % 9 + 1}CD'
+
+# what the local server sends back for each host and path
+class Fixtures:
+    def getResponse(self, host, path, parameters):
+        host = host.lower().split(':')[0]
+
+        if host.startswith('www.'):
+            host = host[4:]
+
+        if host.startswith('google.'):
+            return self.getSearchPage(parameters.get('q', [''])[0])
+
+        if host == 'whois.test':
+            company = self.byDomain.get(path.split('/')[-1], None)
+
+            if company:
+                return 200, 'text/html', f'<html><body><pre>Domain Name: {company.domain}\nRegistrant: {company.name}\n</pre></body></html>'
+
+        # asked for directly, not through the proxy
+        if path == '/v1/companies/suggest':
+            company = self.findCompany(parameters.get('query', [''])[0])
+
+            if company:
+                return 200, 'application/json', json.dumps([{'name': company.name, 'domain': company.domain}])
+
+            return 200, 'application/json', '[]'
+
+        if host in socialDomains:
+            company = self.bySlug.get(path.strip('/'), None)
+
+            if company:
+                return 200, 'text/html', f'<html><head><title>{company.name}</title></head><body>{self.padding}<a href="http://www.{company.domain}/">www.{company.domain}</a></body></html>'
+
+        company = self.byDomain.get(host, None)
+
+        if company:
+            return 200, 'text/html', f'<html><head><title>{company.words.title()} | Home</title></head><body>{company.address}{self.padding}</body></html>'
+
+        return 404, 'text/html', '<html><head><title>Not Found</title></head><body>Not found</body></html>'
+
+    def getSearchPage(self, query):
+        if random.random() < self.captchaRate:
+            return 200, 'text/html', '<html><body>Our systems have detected unusual traffic from your computer network.</body></html>'
+
+        urls = []
+
+        site = ''
+
+        if query.startswith('site:'):
+            site = query.split(' ')[0][5:].lower()
+
+            if site.startswith('www.'):
+                site = site[4:]
+
+        if site in socialDomains:
+            company = self.findCompany(query)
+
+            if company:
+                urls.append(f'http://www.{site}/{company.slug}')
+        elif site:
+            company = self.byDomain.get(site, None)
+
+            if company:
+                urls.append(f'http://www.{company.domain}/contact')
+        else:
+            company = self.findCompany(query)
+
+            if company:
+                # a couple of other candidates to check, like on a real result page
+                urls = [
+                    f'http://www.localnews.test/{company.slug}',
+                    f'http://www.{company.domain}/',
+                    f'http://www.businessdirectory.test/{company.slug}'
+                ]
+
+        if not urls:
+            return 200, 'text/html', '<html><body>Your search - did not match any documents. www.google.com</body></html>'
+
+        links = [f'<div class="g"><a class="result link" href="{url}" ping="/url?sa=t&amp;url={url}"><h3>{url}</h3></a></div>' for url in urls]
+
+        return 200, 'text/html', f'<html><head><title>{query} - Google Search</title></head><body><div id="search">{"".join(links)}</div>{self.serpPadding}</body></html>'
+
+    def findCompany(self, query):
+        tokens = re.findall('[a-z]+', query.lower())
+
+        for i in range(0, len(tokens) - 2):
+            company = self.byWords.get(' '.join(tokens[i:i + 3]), None)
+
+            if company:
+                return company
+
+        return None
+
+    def getPadding(self, kilobytes):
+        block = '<div class="s"><span class="st">Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor.</span></div>'
+
+        return block * int(kilobytes * 1000 / len(block))
+
+    def __init__(self, companies, captchaRate, serpKilobytes):
+        self.byDomain = {company.domain: company for company in companies}
+        self.byWords = {company.words: company for company in companies}
+        self.bySlug = {company.slug: company for company in companies}
+        self.captchaRate = captchaRate
+        self.serpPadding = self.getPadding(serpKilobytes)
+        self.padding = self.getPadding(10)
+
+class FixtureServer(http.server.ThreadingHTTPServer):
+    # the script closes kept alive connections whenever it likes
+    def handle_error(self, request, clientAddress):
+        pass
+
+class FixtureHandler(http.server.BaseHTTPRequestHandler):
+    # keeps connections open like real websites do
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+
+        with server.lock:
+            server.requestCount += 1
+
+        # requests through a proxy have the whole url in the path
+        url = urlparse(self.path)
+        host = url.netloc or self.headers.get('Host', '')
+
+        if server.latency > 0:
+            time.sleep(server.latency * random.uniform(0.5, 1.5))
+
+        if random.random() < server.errorRate:
+            status, contentType, body = 503, 'text/html', '<html><body>Service unavailable</body></html>'
+        else:
+            status, contentType, body = server.fixtures.getResponse(host, url.path, parse_qs(url.query))
+
+        body = body.encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('Content-Type', f'{contentType}; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # only plain http goes through this proxy
+    def do_CONNECT(self):
+        self.send_response(405)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *arguments):
+        pass
+
+def startServer(fixtures, latency, errorRate):
+    server = FixtureServer(('127.0.0.1', 0), FixtureHandler)
+    server.daemon_threads = True
+    server.fixtures = fixtures
+    server.latency = latency
+    server.errorRate = errorRate
+    server.requestCount = 0
+    server.lock = threading.Lock()
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+def createFolder(companies, port, concurrentItems):
+    folder = tempfile.mkdtemp(prefix='domain-finder-benchmark-')
+
+    # the lists of domains to avoid and so on
+    shutil.copytree(os.path.join(root, 'resources'), os.path.join(folder, 'resources'))
+
+    with open(os.path.join(folder, 'input.csv'), 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(['Company Number', 'Company Name', 'Registered Address'])
+
+        for company in companies:
+            writer.writerow([company.number, company.name, company.address])
+
+    helpers.toFile(f'url,port,username,password\n127.0.0.1,{port},benchmark,benchmark\n', os.path.join(folder, 'proxies.csv'))
+
+    options = [
+        '[main]',
+        'inputFile=input.csv',
+        'outputFile=output.csv',
+        'defaultSearchUrl=http://www.google.com',
+        'whoisUrls=http://whois.test/whois/{domain}',
+        f'clearbitUrl=http://127.0.0.1:{port}',
+        'minimumConfidence=450',
+        'preferredDomain=.co.uk',
+        'ignorePatterns=wiktionary.',
+        'ignoreDomains=gov',
+        f'concurrentItems={concurrentItems}',
+        # every run should start from nothing
+        'cacheFile=',
+        'shuffleSeed=1',
+        'retrySeconds=1',
+        'proxyRefreshMinutes=0',
+        'metricsFile=',
+        '',
+        '[rateLimits]',
+        'google.='
+    ]
+
+    helpers.toFile('\n'.join(options) + '\n', os.path.join(folder, 'options.ini'))
+
+    return folder
+
+def getPercentile(values, fraction):
+    if not values:
+        return 0
+
+    values = sorted(values)
+
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+def getPercentileFromHistogram(histogram, buckets, fraction):
+    target = fraction * histogram.count
+
+    previousBound = 0
+    previousCount = 0
+
+    for bound, count in zip(buckets, histogram.counts):
+        if count >= target:
+            # assumes the values are spread evenly inside the bucket
+            return previousBound + (bound - previousBound) * (target - previousCount) / max(count - previousCount, 1)
+
+        previousBound = bound
+        previousCount = count
+
+    return buckets[-1]
+
+def getPeakMegabytes():
+    try:
+        import resource
+    except ImportError:
+        return 0
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # bytes on mac, kilobytes elsewhere
+    if sys.platform == 'darwin':
+        return peak / 1000000
+
+    return peak / 1000
+
+def runFind():
+    import asyncio
+    from main import DomainFinder
+    from other import sessions
+
+    options = {
+        'concurrentItems': 0,
+        'minimumConfidence': 500
+    }
+
+    helpers.setOptions('options.ini', options)
+
+    options['ignorePatterns'] = options['ignorePatterns'].split(',')
+    options['ignoreDomains'] = options['ignoreDomains'].split(',')
+
+    domainFinder = DomainFinder(options)
+
+    items = helpers.getCsvFileAsDictionary('input.csv')
+
+    times = []
+    found = 0
+
+    start = time.time()
+
+    if options['concurrentItems'] <= 0:
+        for item in items:
+            itemStart = time.time()
+
+            if domainFinder.find(item).get('confidence', 0) > 0:
+                found += 1
+
+            times.append(time.time() - itemStart)
+    else:
+        async def doItem(item, semaphore):
+            nonlocal found
+
+            async with semaphore:
+                itemStart = time.time()
+
+                result = await domainFinder.copyForItem().findAsync(item)
+
+                if result.get('confidence', 0) > 0:
+                    found += 1
+
+                times.append(time.time() - itemStart)
+
+        async def doAll():
+            semaphore = asyncio.Semaphore(options['concurrentItems'])
+
+            await asyncio.gather(*[doItem(item, semaphore) for item in items])
+
+            await sessions.closeAsyncSessions()
+
+        asyncio.run(doAll())
+
+    return {
+        'items': len(items),
+        'found': found,
+        'seconds': time.time() - start,
+        'p50': getPercentile(times, 0.5),
+        'p95': getPercentile(times, 0.95),
+        'peakMegabytes': getPeakMegabytes()
+    }
+
+def runMain():
+    from main import Main
+    from other import metrics
+
+    start = time.time()
+
+    Main().run()
+
+    seconds = time.time() - start
+
+    histogram = metrics.registry.histograms.get(('item_seconds', ()), None)
+
+    found = metrics.registry.counters.get(('items_total', (('result', 'done'),)), 0)
+
+    result = {
+        'items': len(helpers.getCsvFileAsDictionary('input.csv')),
+        'found': found,
+        'seconds': seconds,
+        'p50': 0,
+        'p95': 0,
+        'peakMegabytes': getPeakMegabytes()
+    }
+
+    # the script only keeps a histogram of item times
+    if histogram:
+        result['p50'] = getPercentileFromHistogram(histogram, metrics.buckets, 0.5)
+        result['p95'] = getPercentileFromHistogram(histogram, metrics.buckets, 0.95)
+
+    return result
+
+def runMode(mode, folder, server):
+    requestsBefore = server.requestCount
+
+    # the script waits for enter at the end
+    process = subprocess.run([sys.executable, os.path.abspath(__file__), '--run', mode], cwd=folder, input='\n', stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+
+    lines = [line for line in process.stdout.splitlines() if 'RESULT ' in line]
+
+    if not lines:
+        print(process.stdout[-3000:])
+        return None
+
+    result = json.loads(lines[-1].split('RESULT ', 1)[1])
+
+    result['requests'] = server.requestCount - requestsBefore
+
+    return result
+
+def main():
+    mode = helpers.getParameter('--run', False, '')
+
+    # inside the process that gets measured
+    if mode:
+        if mode == 'find':
+            result = runFind()
+        else:
+            result = runMain()
+
+        print('RESULT ' + json.dumps(result))
+        return
+
+    itemCount = int(helpers.getParameter('--items', False, 100))
+    concurrentItems = int(helpers.getParameter('--concurrentItems', False, 0))
+    latency = float(helpers.getParameter('--latency', False, 50)) / 1000
+    errorRate = float(helpers.getParameter('--errorRate', False, 0.02))
+    captchaRate = float(helpers.getParameter('--captchaRate', False, 0))
+    serpKilobytes = float(helpers.getParameter('--serpKilobytes', False, 100))
+    modes = helpers.getParameter('--modes', False, 'find,main').split(',')
+
+    random.seed(1)
+
+    companies = [Company(i) for i in range(0, itemCount)]
+
+    server = startServer(Fixtures(companies, captchaRate, serpKilobytes), latency, errorRate)
+
+    print(f'{itemCount} items. Concurrent items: {concurrentItems}. Latency: {latency * 1000:.0f} ms. Error rate: {errorRate}. Captcha rate: {captchaRate}.')
+    print()
+    print(f'{"mode":<6} {"found":>7} {"seconds":>8} {"items/s":>8} {"requests/item":>14} {"p50 ms":>8} {"p95 ms":>8} {"peak MB":>8}')
+
+    for mode in modes:
+        folder = createFolder(companies, server.server_port, concurrentItems)
+
+        try:
+            result = runMode(mode.strip(), folder, server)
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+
+        if not result:
+            print(f'{mode:<6} failed')
+            continue
+
+        items = max(result['items'], 1)
+
+        print(f'{mode:<6} {result["found"]:>7} {result["seconds"]:>8.1f} {items / result["seconds"]:>8.2f} {result["requests"] / items:>14.1f} {result["p50"] * 1000:>8.0f} {result["p95"] * 1000:>8.0f} {result["peakMegabytes"]:>8.1f}')
+
+    if 'main' in modes:
+        print()
+        print('The main mode\'s item times are estimated from the script\'s histogram.')
+
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+# Measures how long it takes to get the result links out of saved Google result pages.
+#
+# Run it from anywhere: python3 benchmarks/serp.py
+# Optional parameters: --repetitions 50
+
+import sys
+import os
+import glob
+import time
+import lxml.html as lh
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, root)
+os.chdir(root)
+
+import other.helpers as helpers
+from main import DomainFinder
+
+def getSearchResultsWithXpaths(google, page, numberOfResults, acceptAll):
+    # how it used to work. two xpath scans over the whole document. kept here to compare against.
+    result = ''
+
+    if numberOfResults > 1:
+        result = []
+
+    if 'detected unusual traffic from your computer network.' in page:
+        return result
+
+    if 'google.' in page and 'did not match any documents' in page:
+        return result
+
+    xpaths = [
+        "//a[contains(@class, ' ') and (contains(@href, '/url?')  or contains(@ping, '/url?'))]",
+        "//a[contains(@href, '/url?') or contains(@ping, '/url?')]"
+    ]
+
+    document = lh.fromstring(page)
+
+    for xpath in xpaths:
+        for element in document.xpath(xpath):
+            url = element.attrib.get('href', '')
+
+            if google.shouldAvoid(url, acceptAll):
+                continue
+
+            if numberOfResults == 1:
+                result = url
+                break
+            else:
+                result.append(url)
+
+                if len(result) >= numberOfResults:
+                    break
+
+        if numberOfResults == 1 and result:
+            break
+        elif len(result) >= numberOfResults:
+            break
+
+    return result
+
+def measure(function, repetitions):
+    times = []
+
+    for i in range(0, repetitions):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    # the fastest run is the one least disturbed by everything else on the machine
+    return min(times) * 1000
+
+def getUnique(result):
+    if isinstance(result, str):
+        return [result] if result else []
+
+    unique = []
+
+    for item in result:
+        if not item in unique:
+            unique.append(item)
+
+    return unique
+
+def main():
+    repetitions = int(helpers.getParameter('--repetitions', False, 50))
+
+    options = {
+        'defaultSearchUrl': '',
+        'minimumConfidence': 500,
+        'preferredDomain': '',
+        'proxyListUrl': '',
+        'ignorePatterns': '',
+        'ignoreDomains': ''
+    }
+
+    helpers.setOptions('options.ini', options)
+
+    options['ignorePatterns'] = options['ignorePatterns'].split(',')
+    options['ignoreDomains'] = options['ignoreDomains'].split(',')
+
+    google = DomainFinder(options).google
+
+    fileNames = sorted(glob.glob(os.path.join(root, 'benchmarks', 'fixtures', 'serp-*.html')))
+
+    print(f'{"fixture":<20} {"results":>7} {"acceptAll":>9} {"old ms":>8} {"current ms":>11} {"speedup":>8}')
+
+    for fileName in fileNames:
+        page = helpers.getFile(fileName)
+
+        for numberOfResults, acceptAll in [(1, False), (3, True), (20, False)]:
+            old = getSearchResultsWithXpaths(google, page, numberOfResults, acceptAll)
+            new = google.getSearchResults(page, '', numberOfResults, acceptAll)
+
+            # the current version drops duplicates, so compare what's left
+            if getUnique(old) != getUnique(new)[0:len(getUnique(old))]:
+                print(f'Results differ for {fileName}: {old} {new}')
+
+            oldTime = measure(lambda: getSearchResultsWithXpaths(google, page, numberOfResults, acceptAll), repetitions)
+            newTime = measure(lambda: google.getSearchResults(page, '', numberOfResults, acceptAll), repetitions)
+
+            name = helpers.fileNameOnly(fileName, True)
+
+            print(f'{name:<20} {numberOfResults:>7} {str(acceptAll):>9} {oldTime:>8.2f} {newTime:>11.2f} {oldTime / newTime:>7.1f}x')
+
+if __name__ == '__main__':
+    main()
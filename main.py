@@ -5,19 +5,152 @@ import sys
 import random
 import re
 import lxml.html as lh
+from lxml import etree
 import traceback
 import os
 import json
+from collections import OrderedDict
 import other.helpers as helpers
 from other.helpers import Downloader
 from other.api import Api
 from other.database import Database
+from other.database import BatchWriter
+from other import database
+from other import sessions
+from other import cache
+from other import results
+from other import proxypool
+from other import ratelimit
+from other import metrics
+from other import replay
+from other.workqueue import WorkQueue
+from other.inputfile import CsvItemSource
+
+# collects the result links as the parser reads the page
+class ResultLinkTarget:
+    def start(self, tag, attributes):
+        if tag != 'a':
+            return
+
+        href = attributes.get('href', '')
+
+        if not '/url?' in href and not '/url?' in attributes.get('ping', ''):
+            return
+
+        # main results have a space in their class
+        if ' ' in attributes.get('class', ''):
+            self.mainLinks.append(href)
+        else:
+            self.otherLinks.append(href)
+
+    def close(self):
+        return None
+
+    def __init__(self):
+        self.mainLinks = []
+        self.otherLinks = []
 
 class Google:
+    # how much of the page is parsed at a time
+    chunkSize = 16 * 1024
+
     def search(self, query, numberOfResults, urlPrefix=None, acceptAll=False):
-        self.captcha = False        
-        self.searchFailed = False        
+        key = self.getMemoKey(query, urlPrefix, numberOfResults, acceptAll)
+
+        if key in self.memo:
+            return self.getMemoized(key)
+
+        url, parameters = self.getSearchRequest(query, urlPrefix)
+
+        page = self.api.get(url, parameters, False)
 
+        result = self.handlePage(page, query, numberOfResults, acceptAll)
+
+        self.removeCaptchaFromCache(url, parameters)
+
+        self.memoize(key, result)
+
+        return result
+
+    async def searchAsync(self, query, numberOfResults, urlPrefix=None, acceptAll=False, proxies=None):
+        key = self.getMemoKey(query, urlPrefix, numberOfResults, acceptAll)
+
+        if key in self.memo:
+            return self.getMemoized(key)
+
+        url, parameters = self.getSearchRequest(query, urlPrefix)
+
+        page = await self.api.getAsync(url, parameters, False, proxies)
+
+        # no await after this point, so the captcha and searchFailed flags belong to this search
+        self.sharedRequest = self.api.sharedRequest
+
+        result = self.handlePage(page, query, numberOfResults, acceptAll)
+
+        self.memoize(key, result)
+
+        if self.captcha:
+            import asyncio
+
+            searchFailed = self.searchFailed
+            sharedRequest = self.sharedRequest
+
+            # so the next try asks google again. the cache is sqlite, so it's changed off the event loop.
+            await asyncio.to_thread(self.api.removeFromCache, url, parameters)
+
+            # another search might have changed them during the await
+            self.captcha = True
+            self.searchFailed = searchFailed
+            self.sharedRequest = sharedRequest
+
+        return result
+
+    def getMemoKey(self, query, urlPrefix, numberOfResults, acceptAll):
+        # google ignores case and extra spaces
+        normalizedQuery = re.sub(r'\s+', ' ', query).strip().lower()
+
+        return (normalizedQuery, urlPrefix, numberOfResults, acceptAll)
+
+    def getMemoized(self, key):
+        logging.debug(f'Using memoized search results for {key[0]}')
+
+        self.captcha = False
+        self.searchFailed = False
+        self.sharedRequest = False
+
+        self.memo.move_to_end(key)
+
+        result = self.memo[key]
+
+        # so callers can't change the memoized list
+        if isinstance(result, list):
+            result = list(result)
+
+        return result
+
+    def memoize(self, key, result):
+        if self.memoSize <= 0:
+            return
+
+        # want to try these again later
+        if self.captcha or self.searchFailed or result == '':
+            return
+
+        if isinstance(result, list):
+            result = list(result)
+
+        self.memo[key] = result
+        self.memo.move_to_end(key)
+
+        while len(self.memo) > self.memoSize:
+            self.memo.popitem(last=False)
+
+    def removeCaptchaFromCache(self, url, parameters):
+        # so the next try asks google again
+        if self.captcha:
+            self.api.removeFromCache(url, parameters)
+
+    def getSearchRequest(self, query, urlPrefix):
         if not urlPrefix:
             urlPrefix = 'https://www.google.com'
 
@@ -28,7 +161,11 @@ class Google:
 
         url = urlPrefix + '/search'
 
-        page = self.api.get(url, parameters, False)
+        return url, parameters
+
+    def handlePage(self, page, query, numberOfResults, acceptAll):
+        self.captcha = False        
+        self.searchFailed = False        
 
         if not page:
             self.searchFailed = True
@@ -49,7 +186,7 @@ class Google:
 
         if 'detected unusual traffic from your computer network.' in page:
             logging.error(f'There is a captcha')
-            self.captcha = False
+            self.captcha = True
             return result
 
         if 'google.' in page and 'did not match any documents' in page:
@@ -61,44 +198,57 @@ class Google:
             else:
                 return ['no results']
 
-        xpaths = [
-            ["//a[contains(@class, ' ') and (contains(@href, '/url?')  or contains(@ping, '/url?'))]", 'href'],
-            ["//a[contains(@href, '/url?') or contains(@ping, '/url?')]", 'href']
-        ]
+        result = []
+        seen = set()
+
+        # the same link often appears more than once
+        for url in self.getResultLinks(page):
+            if url in seen:
+                continue
 
-        document = lh.fromstring(page)
+            seen.add(url)
 
-        for xpath in xpaths:
-            elements = self.downloader.getXpathInElement(document, xpath[0], False)
+            if self.shouldAvoid(url, acceptAll):
+                continue
 
-            attribute = xpath[1]
+            result.append(url)
 
-            for element in elements:
-                url = element
+            # no need to look at the rest of the page
+            if len(result) >= numberOfResults:
+                break
 
-                if not attribute:
-                    url = element.text_content()
-                else:
-                    url = element.attrib[attribute]
+        if numberOfResults == 1:
+            if result:
+                return result[0]
+            else:
+                return ''
 
-                if self.shouldAvoid(url, acceptAll):
-                    continue
+        return result
 
-                if numberOfResults == 1:
-                    result = url
-                    break
-                else:
-                    result.append(url)
+    def getResultLinks(self, page):
+        # parses the page a piece at a time, so it can stop once the caller has enough links.
+        # no tree is built. the parser only tells the target about each tag.
+        target = ResultLinkTarget()
+        parser = etree.HTMLParser(target=target)
 
-                    if len(result) >= numberOfResults:
-                        break
+        returned = 0
 
-            if numberOfResults == 1 and result:
-                break
-            elif len(result) >= numberOfResults:
-                break
+        for i in range(0, len(page), self.chunkSize):
+            parser.feed(page[i:i + self.chunkSize])
 
-        return result
+            # main results come first
+            while returned < len(target.mainLinks):
+                yield target.mainLinks[returned]
+                returned += 1
+
+        # only gets here if the caller still needs more links
+        try:
+            parser.close()
+        except etree.LxmlError as e:
+            logging.debug(e)
+
+        for url in target.mainLinks[returned:] + target.otherLinks:
+            yield url
 
     def shouldAvoid(self, url, acceptAll):
         result = False
@@ -110,41 +260,49 @@ class Google:
         if not url.startswith('http:') and not url.startswith('https:'):
             return True
 
-        if helpers.substringIsInList(self.avoidPatterns, url):
+        if self.avoidPatternMatcher.getMatch(url) is not None:
             return True
 
         if not acceptAll:
-            if helpers.substringIsInList(self.userAvoidPatterns, url):
-                logging.debug(f'Avoiding {url}. It\'s in userAvoidPatterns.')
+            pattern = self.userAvoidPatternMatcher.getMatch(url)
+
+            if pattern is not None:
+                logging.debug(f'Avoiding {url}. It\'s in userAvoidPatterns: {pattern}.')
                 return True
 
-            if self.domainMatchesList(url, self.userAvoidDomains):
+            if self.domainMatchesList(url, self.userAvoidDomainMatcher):
                 logging.debug(f'Avoiding {url}. It\'s in userAvoidDomains.')
                 return True
 
-            if self.domainMatchesList(url, self.avoidDomains):
+            if self.domainMatchesList(url, self.avoidDomainMatcher):
                 logging.debug(f'Avoiding {url}. It\'s in avoidDomains.')
                 return True
 
         return result
 
-    def domainMatchesList(self, url, list):
+    def domainMatchesList(self, url, matcher):
         result = False
         
         domain = helpers.getDomainName(url)
 
-        if domain in list:
+        item = matcher.getMatch(domain)
+
+        if item is None:
+            return result
+
+        if item == domain:
             logging.debug(f'Skipping. Domain is {domain}.')
-            return True
+        else:
+            logging.debug(f'Skipping. Domain ends with {item}.')
 
-        for item in list:
-            toFind = f'.{item}'
-            
-            if domain.endswith(toFind):
-                logging.debug(f'Skipping. Domain ends with {item}.')
-                return True
+        return True
 
-        return result
+    def compileMatchers(self):
+        # call this after changing the lists
+        self.avoidPatternMatcher = helpers.PatternMatcher(self.avoidPatterns)
+        self.userAvoidPatternMatcher = helpers.PatternMatcher(self.userAvoidPatterns)
+        self.avoidDomainMatcher = helpers.DomainMatcher(self.avoidDomains)
+        self.userAvoidDomainMatcher = helpers.DomainMatcher(self.userAvoidDomains)
 
     def __init__(self):
         self.api = Api('')
@@ -152,8 +310,14 @@ class Google:
         self.proxies = None
         self.captcha = False
         self.avoidDomains = []
+        self.avoidPatterns = []
         self.userAvoidPatterns = []
         self.userAvoidDomains = []
+        self.memo = OrderedDict()
+        self.memoSize = 1000
+        self.sharedRequest = False
+
+        self.compileMatchers()
 
 
 class DomainFinder:
@@ -163,19 +327,9 @@ class DomainFinder:
         self.captcha = False
         self.searchFailed = False
 
-        suffix = ' -https://companieshouse.gov.uk/ -https://www.linkedin.com/'
-        addressPart = self.getAddressForQuery(item)
-
-        # try with and without quotes
-        queries = [
-            self.getQuery(item) + f' {addressPart} {suffix}',
-            item.get('Company Name', '') + f' {addressPart} {suffix}',
-            item.get('Company Name', '')
-        ]
-
         urls = []
 
-        for query in queries:
+        for query in self.getQueries(item):
             urlsForQuery = self.search(query, 20)
 
             urls = self.addIfNew(urls, urlsForQuery)
@@ -183,6 +337,9 @@ class DomainFinder:
             if self.captcha or self.searchFailed:
                 return {}
 
+        # what an earlier try found is out of date
+        self.deleteEvidence(item)
+
         measurementTypes = ['quick', 'detailed']
 
         # do a quick check and if necessary, a detailed check
@@ -195,6 +352,56 @@ class DomainFinder:
             if result:
                 break
 
+        return self.getFinalResult(item, result)
+
+    async def findAsync(self, item):
+        result = {}
+
+        self.captcha = False
+        self.searchFailed = False
+
+        urls = []
+
+        resultsForQueries = await self.searchAllAsync(self.getQueries(item), 20)
+
+        if self.captcha or self.searchFailed:
+            return {}
+
+        # merge in the same order as find
+        for urlsForQuery in resultsForQueries:
+            urls = self.addIfNew(urls, urlsForQuery)
+
+        # what an earlier try found is out of date
+        await database.runAsync(self.deleteEvidence, item)
+
+        measurementTypes = ['quick', 'detailed']
+
+        # do a quick check and if necessary, a detailed check
+        for measurementType in measurementTypes:
+            result = await self.checkUrlsAsync(urls, item, measurementType)
+
+            if self.captcha:
+                return {}
+
+            if result:
+                break
+
+        return self.getFinalResult(item, result)
+
+    def getQueries(self, item):
+        suffix = ' -https://companieshouse.gov.uk/ -https://www.linkedin.com/'
+        addressPart = self.getAddressForQuery(item)
+
+        # try with and without quotes
+        queries = [
+            self.getQuery(item) + f' {addressPart} {suffix}',
+            item.get('Company Name', '') + f' {addressPart} {suffix}',
+            item.get('Company Name', '')
+        ]
+
+        return queries
+
+    def getFinalResult(self, item, result):
         if not result:
             # could not find a result
             result = {
@@ -222,7 +429,170 @@ class DomainFinder:
     def checkUrls(self, urls, item, measurementType):
         result = {}
 
-        minimumConfidenceToStopLooking = 500
+        maximumConfidenceFoundSoFar = 0
+
+        candidates = self.getCandidates(urls, measurementType)
+
+        self.saveCandidateCount(item, measurementType, len(candidates))
+
+        # try several url's if necessary
+        for i, (url, domain) in enumerate(candidates):
+            self.resetConfidence()
+
+            logging.debug(f'Trying result {i + 1} of {len(candidates)}: {domain}')
+
+            self.measureConfidence(item, url, domain, measurementType)
+
+            if self.captcha:
+                return {}
+
+            self.saveEvidence(item, i, url, measurementType)
+
+            if not self.isAcceptable(i, candidates):
+                continue
+
+            # choose the best candidate
+            if self.confidence > maximumConfidenceFoundSoFar:
+                result = self.getCandidateResult(url)
+
+                maximumConfidenceFoundSoFar = self.confidence
+
+            if self.isConfidentEnough():
+                break
+
+        return result
+
+    async def checkUrlsAsync(self, urls, item, measurementType):
+        result = {}
+
+        maximumConfidenceFoundSoFar = 0
+
+        candidates = self.getCandidates(urls, measurementType)
+
+        await database.runAsync(self.saveCandidateCount, item, measurementType, len(candidates))
+
+        measurements = self.measureCandidatesAsync(item, candidates, measurementType)
+
+        try:
+            # try several url's if necessary. they come back in order, so the choice is the same as checkUrls.
+            async for i, url in measurements:
+                if self.captcha:
+                    return {}
+
+                await database.runAsync(self.saveEvidence, item, i, url, measurementType)
+
+                if not self.isAcceptable(i, candidates):
+                    continue
+
+                # choose the best candidate
+                if self.confidence > maximumConfidenceFoundSoFar:
+                    result = self.getCandidateResult(url)
+
+                    maximumConfidenceFoundSoFar = self.confidence
+
+                if self.isConfidentEnough():
+                    break
+        finally:
+            # stops checking candidates that aren't needed anymore
+            await measurements.aclose()
+
+        return result
+
+    # yields each candidate in order after its confidence has been measured into this object
+    async def measureCandidatesAsync(self, item, candidates, measurementType):
+        import asyncio
+
+        # quick checks don't make requests, so there's nothing to gain from running them at the same time
+        if measurementType == 'quick' or self.concurrentCandidates <= 1:
+            for i, (url, domain) in enumerate(candidates):
+                self.resetConfidence()
+
+                logging.debug(f'Trying result {i + 1} of {len(candidates)}: {domain}')
+
+                await self.measureConfidenceAsync(item, url, domain, measurementType)
+
+                yield i, url
+
+            return
+
+        tasks = []
+
+        # candidates after this one can't change the result
+        lastNeeded = len(candidates) - 1
+
+        async def measure(i):
+            url, domain = candidates[i]
+
+            logging.debug(f'Trying result {i + 1} of {len(candidates)}: {domain}')
+
+            domainFinder = self.copyForItem()
+
+            await domainFinder.measureConfidenceAsync(item, url, domain, measurementType)
+
+            return domainFinder
+
+        def onDone(task, i):
+            nonlocal lastNeeded
+
+            if task.cancelled() or task.exception():
+                return
+
+            if not self.stopsLooking(task.result()) or i >= lastNeeded:
+                return
+
+            lastNeeded = i
+
+            for laterTask in tasks[i + 1:]:
+                laterTask.cancel()
+
+        try:
+            for i in range(0, len(candidates)):
+                if i > lastNeeded:
+                    break
+
+                # keep several candidates running ahead of the one that's needed next
+                while len(tasks) <= min(i + self.concurrentCandidates - 1, lastNeeded):
+                    index = len(tasks)
+
+                    task = asyncio.ensure_future(measure(index))
+                    task.add_done_callback(lambda task, index=index: onDone(task, index))
+
+                    tasks.append(task)
+
+                domainFinder = await tasks[i]
+
+                self.copyMeasurement(domainFinder)
+
+                yield i, candidates[i][0]
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stopsLooking(self, domainFinder):
+        # same conditions that make checkUrls return early
+        if domainFinder.captcha:
+            return True
+
+        confidence = domainFinder.confidence
+
+        return confidence >= self.minimumConfidence and confidence >= self.minimumConfidenceToStopLooking
+
+    def copyMeasurement(self, domainFinder):
+        self.testsPassed = domainFinder.testsPassed
+        self.totalTests = domainFinder.totalTests
+        self.confidence = domainFinder.confidence
+        self.maximumPossibleConfidence = domainFinder.maximumPossibleConfidence
+        self.evidence = domainFinder.evidence
+
+        if domainFinder.captcha:
+            self.captcha = True
+
+    def getCandidates(self, urls, measurementType):
+        result = []
+
         maximumDetailedTries = 7
 
         if '--debug' in sys.argv:
@@ -231,27 +601,13 @@ class DomainFinder:
         previousDomain = ''
 
         logging.debug(f'Measurement type: {measurementType}')
-            
-        i = 0
-        tries = 0
-        maximumConfidenceFoundSoFar = 0
 
-        # try several url's if necessary
         for url in urls:
-            self.testsPassed = 0
-            self.totalTests = 0
-            self.confidence = 0
-            self.maximumPossibleConfidence = 0
-
-            if measurementType == 'detailed' and tries >= maximumDetailedTries:
-                logging.debug(f'Stopping. Tried {tries} times in detailed mode.')
+            if measurementType == 'detailed' and len(result) >= maximumDetailedTries:
+                logging.debug(f'Stopping. Tried {len(result)} times in detailed mode.')
                 break
 
-            if not url:
-                i += 1
-                continue
-
-            if url == 'no results':
+            if not url or url == 'no results':
                 continue
 
             domain = helpers.getDomainName(url)
@@ -261,120 +617,259 @@ class DomainFinder:
 
             previousDomain = domain
 
-            logging.debug(f'Trying result {i + 1} of {len(urls)}: {domain}')
+            result.append((url, domain))
 
-            self.measureConfidence(item, url, domain, measurementType)
+        return result
 
-            tries += 1
+    def resetConfidence(self):
+        self.testsPassed = 0
+        self.totalTests = 0
+        self.confidence = 0
+        self.maximumPossibleConfidence = 0
+        self.evidence = {}
 
-            if self.captcha:
-                return {}
-                
-            if self.confidence < self.minimumConfidence:
-                logging.info(f'Confidence is only {self.confidence}. Trying next candidate. On {i + 1} of {len(urls)}.')
-                i += 1
-                continue
+    def isAcceptable(self, i, candidates):
+        if self.confidence < self.minimumConfidence:
+            logging.info(f'Confidence is only {self.confidence}. Trying next candidate. On {i + 1} of {len(candidates)}.')
+            return False
 
-            # choose the best candidate
-            if self.confidence > maximumConfidenceFoundSoFar:
-                result = {
-                    'url': self.getMainPart(url),
-                    'confidence': self.confidence,
-                    'maximumPossibleConfidence': self.maximumPossibleConfidence
-                }
+        return True
 
-                maximumConfidenceFoundSoFar = self.confidence
+    def isConfidentEnough(self):
+        if self.confidence >= self.minimumConfidenceToStopLooking:
+            logging.info(f'Confidence is at least {self.minimumConfidenceToStopLooking}. Not checking more candidates.')
+            return True
 
-            if self.confidence >= minimumConfidenceToStopLooking:
-                logging.info(f'Confidence is at least {minimumConfidenceToStopLooking}. Not checking more candidates.')
-                break
+        return False
+
+    def getCandidateResult(self, url):
+        return {
+            'url': self.getMainPart(url),
+            'confidence': self.confidence,
+            'maximumPossibleConfidence': self.maximumPossibleConfidence
+        }
+
+    def search(self, query, numberOfResults, acceptAll=False, stage='googleSearch'):
+        logging.debug(f'Searching for: {query}')
+
+        proxies = self.getRandomProxy()
+
+        self.google.api.proxies = proxies
+
+        searchUrl = self.defaultSearchUrl
+
+        with metrics.registry.time('stage_seconds', {'stage': stage}):
+            result = self.google.search(query, numberOfResults, searchUrl, acceptAll)
+
+        if self.google.captcha:
+            metrics.registry.increment('captchas_total', {'stage': stage})
+            proxypool.pool.recordCaptcha(proxies)
+
+        self.handleErrors(result)
 
         return result
 
-    def search(self, query, numberOfResults, acceptAll=False):
+    async def searchAsync(self, query, numberOfResults, acceptAll=False, proxies=None, stage='googleSearch'):
         logging.debug(f'Searching for: {query}')
 
-        self.google.api.proxies = self.getRandomProxy()
+        if not proxies:
+            proxies = self.getRandomProxy()
 
         searchUrl = self.defaultSearchUrl
 
-        result = self.google.search(query, numberOfResults, searchUrl, acceptAll)
+        with metrics.registry.time('stage_seconds', {'stage': stage}):
+            result = await self.google.searchAsync(query, numberOfResults, searchUrl, acceptAll, proxies)
+
+        # a search that joined another one's request didn't use these proxies. the other one counts the captcha.
+        if self.google.captcha and not self.google.sharedRequest:
+            metrics.registry.increment('captchas_total', {'stage': stage})
+            proxypool.pool.recordCaptcha(proxies)
 
         self.handleErrors(result)
 
         return result
 
+    # runs the searches at the same time, each on a different proxy if there are enough.
+    # returns the results in the same order as the queries.
+    async def searchAllAsync(self, queries, numberOfResults):
+        import asyncio
+
+        results = []
+
+        domainFinders = [self.copyForItem() for query in queries]
+        proxiesList = self.getDistinctProxies(len(queries))
+
+        tasks = []
+
+        for domainFinder, query, proxies in zip(domainFinders, queries, proxiesList):
+            tasks.append(asyncio.ensure_future(domainFinder.searchAsync(query, numberOfResults, False, proxies)))
+
+        pending = set(tasks)
+
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    domainFinder = domainFinders[tasks.index(task)]
+
+                    # no point waiting for the others. the item gets skipped anyway.
+                    if domainFinder.captcha or domainFinder.searchFailed:
+                        self.captcha = domainFinder.captcha
+                        self.searchFailed = domainFinder.searchFailed
+                        return results
+
+            results = [task.result() for task in tasks]
+        finally:
+            for task in pending:
+                task.cancel()
+
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        return results
+
     def measureConfidence(self, item, url, domain, measurementType):
         self.api.proxies = self.getRandomProxy()
 
-        veryBasicDomain = helpers.findBetween(domain, '', '.')
-        veryBasicDomain = veryBasicDomain.replace('-', '')
+        self.scoreDomain(item, domain)
 
-        self.basicDomain = domain
+        # don't need to check everything in some cases
+        if measurementType == 'quick':
+            return
 
-        basicName = item.get('Company Name', '').lower()
-        basicName = basicName.strip()
-        
+        basicName = self.getBasicName(item)
         filteredName = self.getFilteredName(item)
 
-        score = 0        
-        
-        if domain.endswith(self.preferredDomain):
-            score = 200
+        # given company's address is on the site?
+        addressSearch = self.search(self.getAddressQuery(item, domain), 1, False, 'addressSearch')
+        self.scoreAddress(url, addressSearch)
 
-        self.increaseConfidence(score, 200, f'The domain ends in {self.preferredDomain}.', f'domain ends in {self.preferredDomain}')
+        self.checkWhois(domain, filteredName)
 
-        # does the domain name contain the company name?
-        self.domainContainsRightWords(item, veryBasicDomain)
+        self.checkExternalDomains(domain, basicName)
+
+        # title of the site has the given company name?
+        title = self.getWebsiteTitle(url, domain)
+        self.scoreTitle(url, title, basicName, filteredName)
+
+        self.scoreApi(domain, self.checkApi(item))
+
+    async def measureConfidenceAsync(self, item, url, domain, measurementType):
+        self.scoreDomain(item, domain)
 
         # don't need to check everything in some cases
         if measurementType == 'quick':
             return
 
-        # given company's address is on the site?
-        score = 0
+        import asyncio
+
+        basicName = self.getBasicName(item)
+        filteredName = self.getFilteredName(item)
+
+        externalDomains = self.getExternalDomains()
+
+        # all the checks run at the same time. each request gets its own proxy.
+        addressSearch, whois, externalPages, title, apiDomain = await asyncio.gather(
+            self.searchAsync(self.getAddressQuery(item, domain), 1, False, None, 'addressSearch'),
+            self.getWhoisAsync(domain),
+            asyncio.gather(*[self.findExternalPageAsync(externalDomain, basicName, domain) for externalDomain in externalDomains]),
+            self.getWebsiteTitleAsync(url, domain),
+            self.checkApiAsync(item)
+        )
+
+        # scored in the same order as measureConfidence, whichever check finished first
+        self.scoreAddress(url, addressSearch)
+
+        whoisUrl, whoisPage = whois
+        self.scoreWhois(whoisUrl, whoisPage, domain, filteredName)
+
+        for externalDomain, matchingUrl in zip(externalDomains, externalPages):
+            self.scoreExternalDomain(externalDomain, matchingUrl, domain)
+
+        self.scoreTitle(url, title, basicName, filteredName)
+
+        self.scoreApi(domain, apiDomain)
+
+    def getBasicName(self, item):
+        basicName = item.get('Company Name', '').lower()
+        basicName = basicName.strip()
+
+        return basicName
+
+    def getAddressQuery(self, item, domain):
         address = item.get('Registered Address', '')
         #remove care of
         if 'c/o' in address.lower():
             address = helpers.findBetween(address, ', ', '')
 
-        addressSearch = self.search(f'site:{domain} {address}', 1, False)
+        return f'site:{domain} {address}'
+
+    def scoreDomain(self, item, domain):
+        veryBasicDomain = helpers.findBetween(domain, '', '.')
+        veryBasicDomain = veryBasicDomain.replace('-', '')
+
+        self.basicDomain = domain
+
+        self.evidence['domain'] = domain
+
+        score = 0        
+        
+        if domain.endswith(self.preferredDomain):
+            score = self.weights['preferredDomain']
+
+        self.increaseConfidence(score, self.weights['preferredDomain'], f'The domain ends in {self.preferredDomain}.', f'domain ends in {self.preferredDomain}')
+
+        # does the domain name contain the company name?
+        self.domainContainsRightWords(item, veryBasicDomain)
+
+    def scoreAddress(self, url, addressSearch):
+        score = 0
+
         if addressSearch and addressSearch != 'no results':
-            score = 250
+            score = self.weights['address']
 
-        self.increaseConfidence(score, 250, f'The registered address appears on {url}.', 'address on website')
+        self.evidence['addressHit'] = 1 if score else 0
 
-        self.checkWhois(domain, filteredName)
+        self.increaseConfidence(score, self.weights['address'], f'The registered address appears on {url}.', 'address on website')
 
-        self.checkExternalDomains(domain, basicName)
+    def scoreTitle(self, url, title, basicName, filteredName):
+        self.evidence['title'] = title
 
-        # title of the site has the given company name?
-        page = self.api.getPlain(url)
-        title = self.downloader.getXpath(page, "//title", True)
+        words = self.getWordsInName(basicName)
 
         if filteredName in title.lower():
-            self.increaseConfidence(200, 200, 'Found {filteredName} in title of {url}', 'website title')
+            self.evidence['titleWordRun'] = len(words)
+
+            self.increaseConfidence(self.weights['title'], self.weights['title'], 'Found {filteredName} in title of {url}', 'website title')
         else:
-            words = self.getWordsInName(basicName)
             maximumRun = self.wordsInARowTheSame(words, title, ' ', False)
 
-            self.increaseConfidence(maximumRun * 100, len(words) * 100, f'The title of {url} has {maximumRun} out of {len(words)} words in a row the same as {filteredName}. Title: {title}.', 'website title')
+            self.evidence['titleWordRun'] = maximumRun
+
+            self.increaseConfidence(maximumRun * self.weights['titleWord'], len(words) * self.weights['titleWord'], f'The title of {url} has {maximumRun} out of {len(words)} words in a row the same as {filteredName}. Title: {title}.', 'website title')
 
             score = 0
 
             if len(words) >= 2 and maximumRun == len(words):
-                score = 100
+                score = self.weights['titleWord']
 
-            self.increaseConfidence(score, 100, f'All words in website title match.', 'website title')
+            self.increaseConfidence(score, self.weights['titleWord'], f'All words in website title match.', 'website title')
 
+    def scoreApi(self, domain, apiDomain):
         score = 0
 
-        if self.checkApi(item) == domain:
-            score = 175
+        if apiDomain == domain:
+            score = self.weights['clearbit']
+
+        self.evidence['clearbitDomain'] = apiDomain
 
-        self.increaseConfidence(score, 175, 'The domain from Google matches the domain from another service.', 'check')
+        self.increaseConfidence(score, self.weights['clearbit'], 'The domain from Google matches the domain from another service.', 'check')
 
     def checkExternalDomains(self, domain, basicName):
+        for externalDomain in self.getExternalDomains():
+            self.checkExternalDomain(externalDomain, basicName, domain)
+
+    def getExternalDomains(self):
         # does the company have social media pages?
         externalDomains = [
             'facebook.com',
@@ -382,8 +877,7 @@ class DomainFinder:
             'twitter.com'
         ]
 
-        for externalDomain in externalDomains:
-            self.checkExternalDomain(externalDomain, basicName, domain)
+        return externalDomains
 
     def getWebsiteLinksInSocialMediaPage(self, url):
         results = []
@@ -477,15 +971,9 @@ class DomainFinder:
         return string[:index] + toInsert + string[index:]
 
     def checkExternalDomain(self, domain, basicName, urlToFind):
-        score = 0
-        numberOfResults = 3
-
         logging.debug(f'Checking {domain}')
 
-        if '--debug' in sys.argv:
-            numberOfResults = 2
-
-        urls = self.search(f'site:{domain} {basicName}', numberOfResults, True)
+        urls = self.search(self.getExternalDomainQuery(domain, basicName), self.getExternalDomainResultCount(), True, 'socialSearch')
 
         matchingUrl = ''
 
@@ -498,39 +986,368 @@ class DomainFinder:
 
             if self.urlContainsText(url, urlToFind):
                 matchingUrl = url
-                score = 300
                 break
 
-        self.increaseConfidence(score, 300, f'The company\'s page on {domain} seems to be {matchingUrl} and it contains {urlToFind}.', f'{domain} page')
+        self.scoreExternalDomain(domain, matchingUrl, urlToFind)
 
-    def checkWhois(self, domain, filteredName):
+    async def findExternalPageAsync(self, domain, basicName, urlToFind):
+        logging.debug(f'Checking {domain}')
+
+        urls = await self.searchAsync(self.getExternalDomainQuery(domain, basicName), self.getExternalDomainResultCount(), True, None, 'socialSearch')
+
+        matchingUrl = ''
+
+        # check if those pages contain a given domain
+        for url in urls:
+            if url == 'no results':
+                break
+
+            if await self.urlContainsTextAsync(url, urlToFind):
+                matchingUrl = url
+                break
+
+        return matchingUrl
+
+    def getExternalDomainQuery(self, domain, basicName):
+        return f'site:{domain} {basicName}'
+
+    def getExternalDomainResultCount(self):
+        numberOfResults = 3
+
+        if '--debug' in sys.argv:
+            numberOfResults = 2
+
+        return numberOfResults
+
+    def scoreExternalDomain(self, domain, matchingUrl, urlToFind):
         score = 0
 
-        urls = [
-            f'https://www.namecheap.com/domains/whoislookup-api/{domain}',
-            f'https://www.whois.com/whois/{domain}',
-            f'https://who.is/whois/{domain}'
-        ]
+        if matchingUrl:
+            score = self.weights['socialPage']
+
+        self.evidence.setdefault('socialPages', {})[domain] = matchingUrl
+
+        self.increaseConfidence(score, self.weights['socialPage'], f'The company\'s page on {domain} seems to be {matchingUrl} and it contains {urlToFind}.', f'{domain} page')
+
+    def checkWhois(self, domain, filteredName):
+        url, page = self.getWhois(domain)
 
-        url = random.choice(urls)
+        self.scoreWhois(url, page, domain, filteredName)
+
+    def getWhois(self, domain):
+        evidence = self.getDomainEvidence(domain, 'whois')
+
+        if evidence:
+            metrics.registry.increment('evidence_reused_total', {'stage': 'whois'})
+            return evidence.get('whoisUrl', ''), evidence.get('whois', '')
+
+        url = self.getWhoisUrl(domain)
 
         logging.debug('Checking {url}')
 
-        page = self.api.getPlain(url)
+        with metrics.registry.time('stage_seconds', {'stage': 'whois'}):
+            page = self.api.getPlain(url)
+
+        self.saveWhois(domain, url, page, self.api.statusCode)
+
+        return url, page
+
+    async def getWhoisAsync(self, domain):
+        evidence = await database.runAsync(self.getDomainEvidence, domain, 'whois')
+
+        if evidence:
+            metrics.registry.increment('evidence_reused_total', {'stage': 'whois'})
+            return evidence.get('whoisUrl', ''), evidence.get('whois', '')
+
+        url = self.getWhoisUrl(domain)
+
+        logging.debug('Checking {url}')
+
+        with metrics.registry.time('stage_seconds', {'stage': 'whois'}):
+            page = await self.api.getPlainAsync(url, self.getRandomProxy())
+
+        # read right after the await, before another request can change it
+        statusCode = self.api.statusCode
+
+        await database.runAsync(self.saveWhois, domain, url, page, statusCode)
+
+        return url, page
 
+    def getWebsiteTitle(self, url, domain):
+        evidence = self.getDomainEvidence(domain, 'title')
+
+        if evidence and evidence.get('titleUrl', '') == url:
+            metrics.registry.increment('evidence_reused_total', {'stage': 'title'})
+            return evidence.get('title', '')
+
+        # the title is near the start. no need to download the rest.
+        with metrics.registry.time('stage_seconds', {'stage': 'title'}):
+            page = self.api.getStart(url, '</title>', self.titleMaximumBytes)
+
+        return self.saveTitle(domain, url, page, self.api.statusCode)
+
+    async def getWebsiteTitleAsync(self, url, domain):
+        evidence = await database.runAsync(self.getDomainEvidence, domain, 'title')
+
+        if evidence and evidence.get('titleUrl', '') == url:
+            metrics.registry.increment('evidence_reused_total', {'stage': 'title'})
+            return evidence.get('title', '')
+
+        # the title is near the start. no need to download the rest.
+        with metrics.registry.time('stage_seconds', {'stage': 'title'}):
+            page = await self.api.getStartAsync(url, '</title>', self.titleMaximumBytes, self.getRandomProxy())
+
+        statusCode = self.api.statusCode
+
+        return await database.runAsync(self.saveTitle, domain, url, page, statusCode)
+
+    def getDomainEvidence(self, domain, type):
+        result = {}
+
+        if not self.database or self.domainEvidenceDays <= 0:
+            return result
+
+        row = self.database.getFirst('domains', '*', 'domain = ?', '', '', (domain,))
+
+        if not row or not row.get(f'{type}Date', ''):
+            return result
+
+        maximumAge = self.domainEvidenceDays * 24 * 60 * 60
+
+        # a site that was down might be back soon
+        if type == 'title' and not row.get('reachable', 0):
+            maximumAge = min(maximumAge, 24 * 60 * 60)
+
+        minimumDate = helpers.getDateStringSecondsAgo(maximumAge, True)
+
+        if row.get(f'{type}Date', '') < minimumDate:
+            return result
+
+        logging.debug(f'Using stored {type} information for {domain}')
+
+        return row
+
+    def saveWhois(self, domain, url, page, statusCode):
+        # don't want to remember failed requests or error pages
+        if not page or not self.isSuccessful(statusCode):
+            return
+
+        self.saveDomainEvidence(domain, {
+            'whoisUrl': url,
+            'whois': page,
+            'whoisDate': str(datetime.datetime.utcnow())
+        })
+
+    def saveTitle(self, domain, url, page, statusCode):
+        title = ''
+
+        if page:
+            title = self.downloader.getXpath(page, "//title", True)
+
+        # an error page tells nothing about the site. no answer at all means it's unreachable, which is only remembered for a day.
+        if statusCode and not self.isSuccessful(statusCode):
+            return title
+
+        self.saveDomainEvidence(domain, {
+            'titleUrl': url,
+            'title': title,
+            'reachable': 1 if page else 0,
+            'titleDate': str(datetime.datetime.utcnow())
+        })
+
+        return title
+
+    def isSuccessful(self, statusCode):
+        return statusCode >= 200 and statusCode < 300
+
+    # what was found out about each candidate, so the results can be worked out again without going to the network
+    def saveEvidence(self, item, position, url, measurementType):
+        if not self.database:
+            return
+
+        id = item.get('Company Number', '')
+
+        row = {
+            'id': id,
+            'measurementType': measurementType,
+            'position': position,
+            'url': url,
+            'domain': self.evidence.get('domain', ''),
+            'domainWordRun': self.evidence.get('domainWordRun', 0),
+            'domainWordScore': self.evidence.get('domainWordScore', 0),
+            'addressHit': self.evidence.get('addressHit', None),
+            'whoisHit': self.evidence.get('whoisHit', None),
+            'title': self.evidence.get('title', None),
+            'titleWordRun': self.evidence.get('titleWordRun', None),
+            'clearbitDomain': self.evidence.get('clearbitDomain', None),
+            'gmDate': str(datetime.datetime.utcnow())
+        }
+
+        socialRows = []
+
+        for socialDomain, socialUrl in self.evidence.get('socialPages', {}).items():
+            socialRows.append({
+                'id': id,
+                'measurementType': measurementType,
+                'position': position,
+                'socialDomain': socialDomain,
+                'url': socialUrl
+            })
+
+        self.database.insert('candidates', row)
+        self.database.insertMany('socialPages', socialRows)
+
+    # how many candidates a pass had. the ones after an early stop have no evidence.
+    def saveCandidateCount(self, item, measurementType, count):
+        if not self.database:
+            return
+
+        self.database.execute('insert or replace into candidateCounts (id, measurementType, count) values (?, ?, ?)', (item.get('Company Number', ''), measurementType, count))
+
+    def deleteEvidence(self, item):
+        if not self.database:
+            return
+
+        id = item.get('Company Number', '')
+
+        self.database.execute('delete from candidates where id = ?', (id,))
+        self.database.execute('delete from socialPages where id = ?', (id,))
+        self.database.execute('delete from candidateCounts where id = ?', (id,))
+
+    # chooses a result the same way find does, but from stored evidence
+    # returns None when the stored evidence isn't enough to choose with the current options
+    def rescore(self, item, rows, socialRows, candidateCounts):
+        result = {}
+
+        for measurementType in ['quick', 'detailed']:
+            # this pass never ran. for example the quick pass used to find a result.
+            if not measurementType in candidateCounts:
+                logging.info(f'No {measurementType} evidence for {item.get("Company Name", "")}. It needs to be searched again.')
+                return None
+
+            candidates = [row for row in rows if row['measurementType'] == measurementType]
+
+            result = self.chooseFromEvidence(item, candidates, socialRows, candidateCounts[measurementType])
+
+            if result is None:
+                logging.info(f'Some {measurementType} candidates for {item.get("Company Name", "")} were never checked. It needs to be searched again.')
+                return None
+
+            if result:
+                break
+
+        return self.getFinalResult(item, result)
+
+    # returns None if the choice depends on candidates that weren't checked
+    def chooseFromEvidence(self, item, candidates, socialRows, candidateCount):
+        result = {}
+
+        maximumConfidenceFoundSoFar = 0
+
+        for i, row in enumerate(candidates):
+            self.resetConfidence()
+
+            socialPages = {}
+
+            for socialRow in socialRows:
+                if socialRow['measurementType'] == row['measurementType'] and socialRow['position'] == row['position']:
+                    socialPages[socialRow['socialDomain']] = socialRow['url']
+
+            self.scoreEvidence(item, row, socialPages)
+
+            if not self.isAcceptable(i, candidates):
+                continue
+
+            if self.confidence > maximumConfidenceFoundSoFar:
+                result = self.getCandidateResult(row['url'])
+
+                maximumConfidenceFoundSoFar = self.confidence
+
+            if self.isConfidentEnough():
+                return result
+
+        # the first run stopped early, but now the later candidates would matter
+        if len(candidates) < candidateCount:
+            return None
+
+        return result
+
+    # in the same order as measureConfidence
+    def scoreEvidence(self, item, row, socialPages):
+        url = row['url']
+        domain = row['domain']
+
+        self.scoreDomain(item, domain)
+
+        if row['measurementType'] == 'quick':
+            return
+
+        basicName = self.getBasicName(item)
+        filteredName = self.getFilteredName(item)
+
+        self.scoreAddress(url, url if row['addressHit'] else '')
+
+        self.scoreWhoisHit(row['whoisHit'], domain, filteredName)
+
+        for externalDomain in self.getExternalDomains():
+            self.scoreExternalDomain(externalDomain, socialPages.get(externalDomain, ''), domain)
+
+        self.scoreTitle(url, row['title'] or '', basicName, filteredName)
+
+        self.scoreApi(domain, row['clearbitDomain'] or '')
+
+    def saveDomainEvidence(self, domain, fields):
+        if not self.database or self.domainEvidenceDays <= 0:
+            return
+
+        # keep what's already known about the domain
+        row = self.database.getFirst('domains', '*', 'domain = ?', '', '', (domain,))
+
+        if not row:
+            row = {
+                'domain': domain
+            }
+
+        row.update(fields)
+
+        self.database.insert('domains', row)
+
+    def getWhoisUrl(self, domain):
+        import zlib
+
+        # always the same one for a domain, so a replay asks for what was recorded
+        url = self.whoisUrls[zlib.crc32(domain.encode('utf-8')) % len(self.whoisUrls)]
+
+        return url.strip().replace('{domain}', domain)
+
+    def scoreWhois(self, url, page, domain, filteredName):
         # to avoid false matches
         page = page.replace(domain, '')
 
         if not 'domain name:' in page.lower():
             logging.debug(f'It seems {url} didn\'t return any whois information')
 
-        if filteredName in page.lower():
-            score = 300
+        self.scoreWhoisHit(filteredName in page.lower(), domain, filteredName)
+
+    def scoreWhoisHit(self, hit, domain, filteredName):
+        score = 0
+
+        if hit:
+            score = self.weights['whois']
 
-        self.increaseConfidence(score, 300, f'The whois record for {domain} contains {filteredName}.', 'whois')
+        self.evidence['whoisHit'] = 1 if hit else 0
+
+        self.increaseConfidence(score, self.weights['whois'], f'The whois record for {domain} contains {filteredName}.', 'whois')
 
     def urlContainsText(self, url, text):
-        page = self.api.getPlain(url)
+        with metrics.registry.time('stage_seconds', {'stage': 'socialFetch'}):
+            page = self.api.getPlain(url)
+
+        return text in page.lower()
+
+    async def urlContainsTextAsync(self, url, text):
+        with metrics.registry.time('stage_seconds', {'stage': 'socialFetch'}):
+            page = await self.api.getPlainAsync(url, self.getRandomProxy())
 
         return text in page.lower()
 
@@ -539,9 +1356,25 @@ class DomainFinder:
 
         name = self.getFilteredName(item)
 
-        api = Api('https://autocomplete.clearbit.com')
+        api = Api(self.clearbitUrl)
 
-        response = api.get(f'/v1/companies/suggest?query={name}')
+        with metrics.registry.time('stage_seconds', {'stage': 'clearbit'}):
+            response = api.get(f'/v1/companies/suggest?query={name}')
+
+        if response and len(response) > 0:
+            result = response[0].get('domain', '')
+
+        return result
+
+    async def checkApiAsync(self, item):
+        result = ''
+
+        name = self.getFilteredName(item)
+
+        api = Api(self.clearbitUrl)
+
+        with metrics.registry.time('stage_seconds', {'stage': 'clearbit'}):
+            response = await api.getAsync(f'/v1/companies/suggest?query={name}', None, True, self.getRandomProxy())
 
         if response and len(response) > 0:
             result = response[0].get('domain', '')
@@ -642,6 +1475,9 @@ class DomainFinder:
                 maximumScore = object['score']
                 maximumRun = object['maximumRun']
                 wordLengthForMaximum = len(words)
+
+        self.evidence['domainWordRun'] = maximumRun
+        self.evidence['domainWordScore'] = maximumScore
         
         if maximumRun == wordLengthForMaximum:
             self.increaseConfidence(maximumScore, 500, f'All words match.', 'domain matches company name')
@@ -756,13 +1592,13 @@ class DomainFinder:
     def getProxiesFromApi(self):
         result = None
 
-        externalApi = Api('')
+        externalApi = Api('', useCache=False)
         apiKey = externalApi.getPlain(self.proxyListUrl)
 
         if not apiKey:
             return result
 
-        api = Api('https://api.myprivateproxy.net')
+        api = Api('https://api.myprivateproxy.net', useCache=False)
 
         # get allowed ip's
         allowedIps = api.get(f'/v1/fetchAuthIP/{apiKey}')
@@ -770,7 +1606,7 @@ class DomainFinder:
         if not allowedIps:
             return result
 
-        ipInfoApi = Api('')
+        ipInfoApi = Api('', useCache=False)
 
         currentIp = ipInfoApi.get('https://ipinfo.io/json')
 
@@ -807,25 +1643,58 @@ class DomainFinder:
                 'password': item.get('password', ''),
             }
 
-            result.append(newItem)
+            result.append(newItem)
+
+        return result
+
+    def loadProxies(self):
+        # nothing goes to the network
+        if replay.store.isReplaying():
+            return
+
+        # only loads the first time. after that the list is refreshed in the background.
+        proxypool.pool.load(self.getProxyList, self.proxyRefreshSeconds)
 
-        return result
+    def getProxyList(self):
+        items = None
+
+        if os.path.exists('proxies.csv'):
+            items = helpers.getCsvFileAsDictionary('proxies.csv')
+        elif self.proxyListUrl:            
+            items = self.getProxiesFromApi()
+
+        if not items:
+            logging.info('No proxies found')
+            return []
+
+        return [self.getProxyUrl(item) for item in items]
 
     def getRandomProxy(self):
-        if not self.proxies:
-            if os.path.exists('proxies.csv'):
-                self.proxies = helpers.getCsvFileAsDictionary('proxies.csv')
-            elif self.proxyListUrl:            
-                self.proxies = self.getProxiesFromApi()
+        return self.getDistinctProxies(1)[0]
 
-            if not self.proxies:
-                logging.info('No proxies found')
+    def getDistinctProxies(self, count):
+        self.loadProxies()
 
-        if not self.proxies:
-            return None
+        # healthier proxies are more likely to be chosen
+        urls = proxypool.pool.choose(count)
+
+        if not urls:
+            return [None] * count
 
-        item = random.choice(self.proxies)
+        return [self.getProxiesForUrl(url) for url in urls]
+
+    def getProxiesForUrl(self, proxy):
+        # the session pool is keyed by this url, so a proxy that comes up again reuses its open connections
+        proxies = {
+            'http': proxy,
+            'https': proxy
+        }
+
+        logging.debug(f'Using proxy {proxypool.pool.getDescription(proxy)}')
+
+        return proxies
 
+    def getProxyUrl(self, item):
         url = item.get('url', '')
         port = item.get('port', '')
         userName = item.get('username', '')
@@ -836,31 +1705,67 @@ class DomainFinder:
         if not userName or not password:
             proxy = f'http://{url}:{port}'
 
-        proxies = {
-            'http': proxy,
-            'https': proxy
-        }
+        return proxy
 
-        logging.debug(f'Using proxy http://{url}:{port}')
+    def copyForItem(self):
+        import copy
 
-        return proxies
+        # lets several items be worked on at once. each copy keeps its own confidence and error state.
+        result = copy.copy(self)
+        result.google = copy.copy(self.google)
+        result.captcha = False
+        result.searchFailed = False
+        result.resetConfidence()
+
+        return result
 
-    def __init__(self, options):
+    def __init__(self, options, database=None):
         self.api = Api('')
+        self.database = database
+        self.domainEvidenceDays = int(options.get('domainEvidenceDays', 30))
+        self.titleMaximumBytes = int(options.get('titleMaximumKilobytes', 64)) * 1000
         self.downloader = Downloader()
         self.google = Google()
-        self.proxies = None
         self.defaultSearchUrl = options.get('defaultSearchUrl', '')
+
+        # how much each check adds to the confidence
+        self.weights = {
+            'preferredDomain': 200,
+            'address': 250,
+            'whois': 300,
+            'socialPage': 300,
+            'title': 200,
+            'titleWord': 100,
+            'clearbit': 175
+        }
+
+        for key, value in options.get('weights', {}).items():
+            self.weights[key] = int(value)
+
+        self.evidence = {}
+        self.whoisUrls = options.get('whoisUrls', 'https://www.namecheap.com/domains/whoislookup-api/{domain},https://www.whois.com/whois/{domain},https://who.is/whois/{domain}').split(',')
+        self.clearbitUrl = options.get('clearbitUrl', 'https://autocomplete.clearbit.com')
         self.captcha = False
         self.searchFailed = False
         self.minimumConfidence = options.get('minimumConfidence', '')
+        self.minimumConfidenceToStopLooking = 500
+        self.concurrentCandidates = int(options.get('concurrentCandidates', 3))
         self.preferredDomain = options.get('preferredDomain', '')
         self.proxyListUrl = options.get('proxyListUrl', '')
+        self.proxyRefreshSeconds = int(options.get('proxyRefreshMinutes', 30)) * 60
         self.testsPassed = 0
         self.totalTests = 0
         self.confidence = 0
         self.maximumPossibleConfidence = 0
 
+        sessions.pool.configure(options.get('sessionPoolSize', ''), options.get('sessionIdleSeconds', ''))
+
+        cache.responses.configure(options)
+
+        proxypool.pool.configure(int(options.get('proxyCaptchaCooldownMinutes', 10)) * 60, options.get('proxyErrorCooldownSeconds', 60))
+
+        self.google.memoSize = int(options.get('searchMemoSize', self.google.memoSize))
+
         file = helpers.getFile('resources/top-domains.csv')
         self.google.avoidDomains = file.splitlines()
 
@@ -876,119 +1781,443 @@ class DomainFinder:
         if options.get('ignoreDomains', ''):
             self.google.userAvoidDomains = options['ignoreDomains']
 
+        self.google.compileMatchers()
+
 class Main:
     def run(self):
         self.initialize()
 
-        self.sliceItems()
+        try:
+            while True:
+                self.tryIteration()
 
-        while True:
-            self.tryIteration()
+                itemsDone, itemsParked, totalItems = self.queue.getCounts()
             
-            logging.info(f'Done {self.itemsDone} of {len(self.items)}')
+                logging.info(f'Done {itemsDone} of {totalItems}')
+
+                if itemsParked:
+                    logging.info(f'Gave up on {itemsParked} items after {self.queue.maximumAttempts} tries. Run with --retryParked to try them again.')
             
-            if self.itemsDone >= len(self.items):
-                logging.info(f'Done all items')
-                break
-            else:
-                logging.info(f'Don\'t have all the results yet. Will try again in a few seconds.')
-                time.sleep(10)
+                if itemsDone + itemsParked >= totalItems:
+                    if not itemsParked:
+                        logging.info(f'Done all items')
+
+                    break
+                else:
+                    # only the items that failed or are being worked on elsewhere are left
+                    seconds = min(max(self.queue.getSecondsUntilNextItem(), 1), 10)
+
+                    logging.info(f'Don\'t have all the results yet. Will try again in {seconds:.0f} seconds.')
+                    time.sleep(seconds)
+        finally:
+            # buffered results belong to items that are already marked done, so they have to be written even after ctrl+c or an error
+            self.closeOutput()
 
         self.cleanUp()
 
     def tryIteration(self):
         self.onItemIndex = 0
-        self.itemsDone = 0
+
+        self.refreshDoneIds()
+
+        if self.options['concurrentItems'] > 0:
+            import asyncio
+
+            # the first load downloads the list. better here than on the event loop.
+            self.domainFinder.loadProxies()
+
+            asyncio.run(self.tryIterationAsync())
+            return
         
-        for item in self.items:
+        while True:
+            item = self.getNextItem()
+
+            if not item:
+                break
+
             try:
                 self.doItem(item)
             except Exception as e:
                 logging.error(f'Skipping. Something went wrong: {e}')
                 logging.debug(traceback.format_exc())
+                self.retryItem(self.getItemId(item))
 
             self.onItemIndex += 1
 
+    async def tryIterationAsync(self):
+        import asyncio
+        from other import sessions
+
+        # each worker takes the next item as soon as it's free
+        async def worker():
+            while True:
+                item = await database.runAsync(self.getNextItem)
+
+                if not item:
+                    break
+
+                try:
+                    await self.doItemAsync(item)
+                except Exception as e:
+                    logging.error(f'Skipping. Something went wrong: {e}')
+                    logging.debug(traceback.format_exc())
+                    await database.runAsync(self.retryItem, self.getItemId(item))
+
+        workers = [worker() for i in range(0, self.options['concurrentItems'])]
+
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            await sessions.closeAsyncSessions()
+
     def combine(self):
         logging.info('Combining results from all threads')
 
         outputFile = self.options['outputFile']
 
-        helpers.removeFile(outputFile)
-        
-        while True:
-            itemsFound = 0
+        self.loadCombineItems()
 
-            for item in self.items:
-                try:
-                    id = item.get('Company Number', '')
+        if '--wait' in sys.argv:
+            self.waitForResults()
+
+        helpers.removeFile(results.getFileName(outputFile, self.options['outputFormat']))
+
+        itemsFound = 0
+        missingIds = []
+
+        # one query for everything. rows come back in the same order as the input file.
+        query = 'select combineItems.position, combineItems.id, history.result, history.confidence, history.maximumPossibleConfidence from combineItems left join history on history.id = combineItems.id order by combineItems.position'
+
+        sink = self.getSink()
+
+        for row in self.database.iterate(query):
+            try:
+                item = self.items[row['position']]
+
+                if row['result'] is None:
+                    missingIds.append(row['id'])
+                    continue
+
+                fields = {
+                    'url': row['result'],
+                    'confidence': row['confidence'],
+                    'maximumPossibleConfidence': row['maximumPossibleConfidence']
+                }
+
+                sink.write(self.getOutputRow(item, fields))
+
+                itemsFound += 1
+            except Exception as e:
+                logging.error(f'Skipping. Something went wrong: {e}')
+                logging.debug(traceback.format_exc())
+
+        # the script exits right after this
+        sink.close()
+        self.sink = None
+
+        logging.info(f'Wrote {itemsFound} of {len(self.items)} to {sink.fileName}')
+
+        if missingIds:
+            self.reportMissingIds(missingIds)
+        else:
+            logging.info(f'Wrote all items')
+
+        self.cleanUp()
+
+    def rescore(self):
+        logging.info('Choosing the results again from the stored evidence')
+
+        helpers.removeFile(results.getFileName(self.options['outputFile'], self.options['outputFormat']))
+
+        sink = self.getSink()
+
+        itemsRescored = 0
+        itemsChanged = 0
+        missingIds = []
+        needsSearchIds = []
+
+        for row, item in self.items.iterate():
+            id = item.get('Company Number', '')
+
+            if not id:
+                continue
+
+            try:
+                candidates = self.database.get('candidates', '*', 'id = ?', 'position', 'asc', None, (id,))
+                previous = self.database.getFirst('history', '*', 'id = ?', '', '', (id,))
 
-                    if not id:
+                # done before evidence was stored. keep what it found.
+                if not candidates:
+                    if not previous:
+                        missingIds.append(id)
                         continue
-                    
-                    row = self.database.getFirst('history', '*', f"id = '{id}'", '', '')
 
-                    if not row:
+                    sink.write(self.getOutputRow(item, self.getPreviousResult(previous)))
+                    continue
+
+                socialRows = self.database.get('socialPages', '*', 'id = ?', '', '', None, (id,))
+                candidateCounts = {row['measurementType']: row['count'] for row in self.database.get('candidateCounts', '*', 'id = ?', '', '', None, (id,))}
+
+                finderResult = self.domainFinder.rescore(item, candidates, socialRows, candidateCounts)
+
+                # not enough evidence. keep what the last search found.
+                if finderResult is None:
+                    needsSearchIds.append(id)
+
+                    if not previous:
                         continue
 
-                    fields = {
-                        'url': row.get('result', ''),
-                        'confidence': row.get('confidence', ''),
-                        'maximumPossibleConfidence': row.get('maximumPossibleConfidence', '')
-                    }
+                    sink.write(self.getOutputRow(item, self.getPreviousResult(previous)))
+                    continue
+
+                if finderResult.get('url', '') != previous.get('result', ''):
+                    itemsChanged += 1
 
-                    self.outputResult(item, fields, True)
+                self.markDone(item, finderResult)
 
-                    itemsFound += 1
-                except Exception as e:
-                    logging.error(f'Skipping. Something went wrong: {e}')
-                    logging.debug(traceback.format_exc())
+                sink.write(self.getOutputRow(item, finderResult))
+
+                itemsRescored += 1
+            except Exception as e:
+                logging.error(f'Skipping. Something went wrong: {e}')
+                logging.debug(traceback.format_exc())
+
+        # the script exits right after this
+        sink.close()
+        self.sink = None
+
+        logging.info(f'Chose the results for {itemsRescored} items again. {itemsChanged} of them changed. Wrote them to {sink.fileName}.')
+
+        if missingIds:
+            self.reportMissingIds(missingIds)
+
+        if needsSearchIds:
+            fileName = os.path.join('logs', 'needs-search.csv')
+
+            helpers.toFile('\n'.join(['Company Number'] + needsSearchIds), fileName)
+
+            logging.info(f'Kept the old results for {len(needsSearchIds)} items. The stored evidence isn\'t enough to choose with the current options. Their ids are in {fileName}. Delete them from the history table and run again to search for them again.')
+
+        self.cleanUp()
+
+    def getPreviousResult(self, previous):
+        return {
+            'url': previous.get('result', ''),
+            'confidence': previous.get('confidence', 0),
+            'maximumPossibleConfidence': previous.get('maximumPossibleConfidence', 0)
+        }
+
+    def loadCombineItems(self):
+        self.database.execute('create temp table if not exists combineItems ( position integer, id text )')
+        self.database.execute('delete from combineItems')
+
+        # read as they're inserted
+        rows = ((row, item.get('Company Number', '')) for row, item in self.items.iterate() if item.get('Company Number', ''))
+
+        self.database.executeMany('insert into combineItems (position, id) values (?, ?)', rows)
+
+    def waitForResults(self):
+        total = self.database.getFirst('combineItems', 'count(distinct id) as total', '', '', '').get('total', 0)
+
+        # parked items never get a result, so the queue says when the workers are finished
+        queue = WorkQueue('database.sqlite', self.options['inputFile'], self.options['queueLeaseSeconds'])
+
+        # the last few results can still be on their way to the database
+        finishedBefore = False
+
+        try:
+            # just counts. the rows are only read once they're all there.
+            while True:
+                row = self.database.getFirst('history', 'count(*) as done', 'id in (select id from combineItems)', '', '')
+
+                done = row.get('done', 0)
+
+                logging.info(f'Have results for {done} of {total}')
+
+                if done >= total:
+                    break
+
+                # the workers made the queue from this version of the input file and have nothing left to do
+                finished = queue.isCurrent(self.items.fingerprint) and queue.getPendingCount() == 0
+
+                if finished and finishedBefore:
+                    parkedIds = queue.getParkedIds()
+
+                    if parkedIds:
+                        logging.info(f'The workers are finished. They gave up on {len(parkedIds)} items. Run with --retryParked to try them again.')
+
+                    break
+
+                finishedBefore = finished
 
-            logging.info(f'Wrote {itemsFound} of {len(self.items)} to {outputFile}')
-            
-            if itemsFound >= len(self.items):
-                logging.info(f'Wrote all items')
-                break
-            else:
                 logging.info(f'Don\'t have all the results yet. Will check again in a few seconds.')
                 time.sleep(10)
+        finally:
+            queue.close()
 
-        self.cleanUp()
+    def reportMissingIds(self, missingIds):
+        fileName = os.path.join('logs', 'missing.csv')
+
+        helpers.toFile('\n'.join(['Company Number'] + missingIds), fileName)
+
+        logging.info(f'Don\'t have results for {len(missingIds)} items. Their ids are in {fileName}. For example: {", ".join(missingIds[0:10])}.')
 
     def doItem(self, item):
         self.showStatus(item)
 
+        id = self.getItemId(item)
         name = item.get('Company Name', '')
 
         if not name:
+            self.queue.finish(id)
             return
 
         if self.isDone(item):
-            self.itemsDone += 1
+            self.queue.finish(id)
             return
 
         try:
-            finderResult = self.domainFinder.find(item)
+            with metrics.registry.time('item_seconds'):
+                finderResult = self.domainFinder.find(item)
 
             if finderResult:
                 self.outputResult(item, finderResult)
                 self.markDone(item, finderResult)
-                self.waitBetween()
-                self.itemsDone += 1
+                self.queue.finish(id)
+                metrics.registry.increment('items_total', {'result': 'done'})
+            else:
+                self.retryItem(id)
+                metrics.registry.increment('items_total', {'result': 'failed'})
+        except Exception as e:
+            logging.error(f'Skipping. Something went wrong: {e}')
+            self.retryItem(id)
+            metrics.registry.increment('items_total', {'result': 'error'})
+
+    async def doItemAsync(self, item):
+        self.showStatus(item)
+
+        self.onItemIndex += 1
+
+        id = self.getItemId(item)
+        name = item.get('Company Name', '')
+
+        if not name:
+            await database.runAsync(self.queue.finish, id)
+            return
+
+        if self.isDone(item):
+            await database.runAsync(self.queue.finish, id)
+            return
+
+        try:
+            domainFinder = self.domainFinder.copyForItem()
+
+            with metrics.registry.time('item_seconds'):
+                finderResult = await domainFinder.findAsync(item)
+
+            if finderResult:
+                await database.runAsync(self.finishItem, item, finderResult)
+                metrics.registry.increment('items_total', {'result': 'done'})
+            else:
+                await database.runAsync(self.retryItem, id)
+                metrics.registry.increment('items_total', {'result': 'failed'})
         except Exception as e:
             logging.error(f'Skipping. Something went wrong: {e}')
+            await database.runAsync(self.retryItem, id)
+            metrics.registry.increment('items_total', {'result': 'error'})
+
+    def retryItem(self, id):
+        # a replay store gives the same answers every time, so trying again would only log the same misses
+        self.queue.retryLater(id, replay.store.isReplaying())
+
+    def finishItem(self, item, finderResult):
+        self.outputResult(item, finderResult)
+        self.markDone(item, finderResult)
+        self.queue.finish(self.getItemId(item))
+
+    def getNextItem(self):
+        # take a new batch when this worker runs out
+        if not self.claimedRows:
+            batchSize = max(self.options['queueBatchSize'], self.options['concurrentItems'])
+
+            self.claimedRows = self.queue.claim(batchSize)
+        else:
+            self.queue.renewIfNeeded()
+
+        if not self.claimedRows:
+            return None
+
+        id, row = self.claimedRows.pop(0)
+
+        # another worker might have made the queue from a longer version of the input file
+        if row < len(self.items):
+            # reads just this row from the input file
+            item = self.items[row]
 
-    def sliceItems(self):
-        if self.threadCount <= 1:
+            if self.getItemId(item) == id:
+                return item
+
+        # the input file was replaced while this worker was running
+        logging.info(f'Row {row + 1} in {self.options["inputFile"]} isn\'t {id} anymore. Reading the input file again.')
+
+        fingerprint = self.items.fingerprint
+
+        self.items.close()
+        self.items = CsvItemSource(self.options['inputFile'])
+
+        if self.items.fingerprint == fingerprint:
+            # nothing changed, so reading it again won't help
+            self.queue.retryLater(id)
+            return self.getNextItem()
+
+        self.queue.release(id)
+
+        for otherId, otherRow in self.claimedRows:
+            self.queue.release(otherId)
+
+        self.claimedRows = []
+
+        self.syncQueue()
+
+        return self.getNextItem()
+
+    def getItemId(self, item):
+        return item.get('Company Number', '') or item.get('Company Name', '')
+
+    def createQueue(self):
+        self.queue = WorkQueue('database.sqlite', self.options['inputFile'], self.options['queueLeaseSeconds'])
+        self.queue.configureRetries(self.options['retryMaximumAttempts'], self.options['retrySeconds'], self.options['retryMaximumSeconds'])
+        self.claimedRows = []
+
+        self.syncQueue()
+
+        self.queue.resetDeleted()
+
+        if '--retryParked' in sys.argv:
+            self.queue.unpark()
+
+    # the queue is made again from the input file whenever the file changes, even if it has the same name
+    def syncQueue(self):
+        if self.queue.isCurrent(self.items.fingerprint):
             return
 
-        start = len(self.items) // self.threadCount * (self.threadNumber - 1)
-        end = start + (len(self.items) // self.threadCount)
+        logging.info(f'Adding the {len(self.items)} items in {self.options["inputFile"]} to the queue')
+
+        positions = self.getPositions()
 
-        if self.threadNumber == self.threadCount or end == 0:
-            end = len(self.items)
+        self.queue.add(((self.getItemId(item), row, positions[row]) for row, item in self.items.iterate()), self.items.fingerprint)
 
-        self.items = self.items[start:end]
+    def getPositions(self):
+        if '--debug' in sys.argv:
+            return range(0, len(self.items))
+
+        seed = self.options['shuffleSeed']
+
+        # same seed, same order
+        if seed == '':
+            seed = None
+
+        return self.items.getShuffledPositions(seed)
     
     def showStatus(self, item):
         name = item.get('Company Name', '')
@@ -1001,21 +2230,55 @@ class Main:
 
         id = item.get('Company Number', '')
 
-        row = self.database.getFirst('history', 'id', f"id = '{id}'", '', '')
-
-        if row:
+        if id in self.doneIds:
             logging.info(f'Skipping. Already done this item.')
             result = True
 
         return result
 
+    def refreshDoneIds(self):
+        where = ''
+        parameters = ()
+
+        # only rows that are new since the last time. other processes add rows too.
+        if self.lastDoneDate:
+            # a bit of overlap in case another process wrote a row late
+            cutoff = datetime.datetime.fromisoformat(self.lastDoneDate) - datetime.timedelta(seconds=60)
+
+            where = 'gmDate >= ?'
+            parameters = (str(cutoff),)
+
+        rows = self.database.get('history', 'id, gmDate', where, '', '', None, parameters)
+
+        for row in rows:
+            self.doneIds.add(row.get('id', ''))
+
+            gmDate = row.get('gmDate', '') or ''
+
+            if gmDate > self.lastDoneDate:
+                self.lastDoneDate = gmDate
+
+        logging.debug(f'Read {len(rows)} done items. {len(self.doneIds)} in total.')
+
     def outputResult(self, item, finderResult, force=False):
         if not force and self.threadCount > 1:
             return
 
-        if not os.path.exists(self.options['outputFile']):
-            helpers.toFile('Company Number,Company Name,Date Incorporated,Active Directors,Registered Address,Website,Website Confidence', self.options['outputFile'])
+        values = self.getOutputRow(item, finderResult)
+
+        self.getSink().write(values)
+
+    def getSink(self):
+        # opened once and kept open until the end
+        if not self.sink:
+            self.sink = results.getSink(self.options['outputFile'], self.options['outputFormat'], self.getOutputHeader(), self.options['outputBufferRows'], self.options['outputBufferSeconds'])
 
+        return self.sink
+
+    def getOutputHeader(self):
+        return ['Company Number', 'Company Name', 'Date Incorporated', 'Active Directors', 'Registered Address', 'Website', 'Website Confidence']
+
+    def getOutputRow(self, item, finderResult):
         fields = [
             'Company Number',
             'Company Name',
@@ -1043,13 +2306,7 @@ class Main:
         values.append(finderResult.get('url', ''))
         values.append(percentage)
 
-        self.appendCsvFile(values, self.options['outputFile'])
-
-    def appendCsvFile(self, list, fileName):
-        import csv
-        with open(fileName, "a", newline='\n', encoding='utf-8') as csv_file:
-            writer = csv.writer(csv_file, delimiter=',')
-            writer.writerow(list)
+        return values
 
     def markDone(self, item, finderResult):
         if not finderResult.get('url', ''):
@@ -1067,17 +2324,12 @@ class Main:
         logging.debug(f'Inserting into database')
         logging.debug(item)
 
-        self.database.insert('history', item)
-
-    def waitBetween(self):
-        secondsBetweenItems = self.options['secondsBetweenItems']
-
-        if not secondsBetweenItems:
-            return
-
-        logging.info(f'Waiting {secondsBetweenItems} seconds')
+        if self.writer:
+            self.writer.insert('history', item)
+        else:
+            self.database.insert('history', item)
 
-        time.sleep(secondsBetweenItems)
+        self.doneIds.add(item['id'])
 
     def deleteResultsToAvoid(self):
         rows = self.database.get('history', '*', "result != 'none'", '', '')
@@ -1093,11 +2345,79 @@ class Main:
 
                 logging.info(f'Deleting result for {name} because it matches a pattern to ignore. Url: {url}.')
 
-                self.database.execute(f"delete from history where id = '{id}'")
+                self.database.execute('delete from history where id = ?', (id,))
+
+    def startMetrics(self, fileNameSuffix):
+        # each worker has its own file and port
+        fileName = self.options['metricsFile']
+
+        if fileName:
+            base, extension = os.path.splitext(fileName)
+            fileName = base + fileNameSuffix + extension
+
+        port = self.options['metricsPort']
+
+        if port:
+            port += int(self.threadNumber) - 1
+
+        metrics.registry.start(fileName, self.options['metricsSeconds'], port)
+
+    def startReplay(self, fileNameSuffix):
+        self.replayMissesFileName = os.path.join('logs', f'replay-misses{fileNameSuffix}.txt')
+
+        replayFile = helpers.getParameter('--replay', False, '')
+        recordFile = helpers.getParameter('--record', False, '')
+
+        if replayFile and recordFile:
+            logging.error('Use either --replay or --record, not both')
+            exit()
+
+        if replayFile:
+            if not os.path.exists(replayFile):
+                logging.error(f'{replayFile} doesn\'t exist. Record it first with --record {replayFile}.')
+                exit()
+
+            replay.store.start('replay', replayFile)
+        elif recordFile:
+            replay.store.start('record', recordFile)
+
+    # writes what's still waiting
+    def closeOutput(self):
+        if getattr(self, 'writer', None):
+            self.writer.close()
+            self.writer = None
+
+        if getattr(self, 'sink', None):
+            self.sink.close()
+            self.sink = None
 
     def cleanUp(self):
+        if getattr(self, 'queue', None):
+            self.queue.close()
+
+        self.closeOutput()
+
+        if getattr(self, 'items', None):
+            self.items.close()
+
         self.database.close()
 
+        proxypool.pool.stop()
+
+        statistics = proxypool.pool.getStatistics()
+        logging.info(f'Proxies: {statistics["proxies"]}. Resting: {statistics["resting"]}.')
+
+        sessions.pool.closeAll()
+
+        statistics = cache.responses.getStatistics()
+        logging.info(f'Cache hits: {statistics["hits"]}. Misses: {statistics["misses"]}. Evictions: {statistics["evictions"]}.')
+
+        cache.responses.close()
+
+        replay.store.close(self.replayMissesFileName)
+
+        metrics.registry.stop()
+
         logging.info('Done')
         input("Press enter to exit...")
 
@@ -1122,17 +2442,55 @@ class Main:
         logging.info('Starting\n')
 
         self.onItemIndex = 0
+        self.sink = None
+        self.doneIds = set()
+        self.lastDoneDate = ''
 
         self.database = Database('database.sqlite')
         self.database.execute('create table if not exists history ( id text, name text, result text, confidence integer, maximumPossibleConfidence integer, gmDate text, primary key(id) )')
+        self.database.execute('create index if not exists historyGmDate on history (gmDate)')
+        self.database.execute('create table if not exists domains ( domain text, whoisUrl text, whois text, whoisDate text, titleUrl text, title text, reachable integer, titleDate text, primary key(domain) )')
+        self.database.execute('create table if not exists candidates ( id text, measurementType text, position integer, url text, domain text, domainWordRun integer, domainWordScore integer, addressHit integer, whoisHit integer, title text, titleWordRun integer, clearbitDomain text, gmDate text, primary key(id, measurementType, position) )')
+        self.database.execute('create table if not exists candidateCounts ( id text, measurementType text, count integer, primary key(id, measurementType) )')
+        self.database.execute('create table if not exists socialPages ( id text, measurementType text, position integer, socialDomain text, url text, primary key(id, measurementType, position, socialDomain) )')
 
         # set default options
         self.options = {
             'inputFile': 'input.csv',
             'outputFile': 'output.csv',
-            'secondsBetweenItems': 3,
+            'outputFormat': 'csv',
+            'outputBufferRows': 100,
+            'outputBufferSeconds': 10,
+            'concurrentItems': 0,
+            'concurrentCandidates': 3,
+            'queueBatchSize': 10,
+            'queueLeaseSeconds': 300,
+            'shuffleSeed': '',
+            'retryMaximumAttempts': 5,
+            'retrySeconds': 10,
+            'retryMaximumSeconds': 600,
+            'writeBatchSize': 0,
+            'writeBatchMilliseconds': 1000,
+            'proxyRefreshMinutes': 30,
+            'proxyCaptchaCooldownMinutes': 10,
+            'proxyErrorCooldownSeconds': 60,
+            'metricsFile': 'logs/metrics.json',
+            'metricsSeconds': 30,
+            'metricsPort': 0,
+            'sessionPoolSize': 100,
+            'sessionIdleSeconds': 60,
+            'cacheFile': 'logs/cache.sqlite',
+            'cacheMaximumMegabytes': 500,
+            'cacheHoursHtml': 168,
+            'cacheHoursJson': 24,
+            'cacheHoursOther': 24,
+            'searchMemoSize': 1000,
+            'domainEvidenceDays': 30,
+            'titleMaximumKilobytes': 64,
             'maximumDaysToKeepItems': 90,
             'defaultSearchUrl': '',
+            'whoisUrls': 'https://www.namecheap.com/domains/whoislookup-api/{domain},https://www.whois.com/whois/{domain},https://who.is/whois/{domain}',
+            'clearbitUrl': 'https://autocomplete.clearbit.com',
             'minimumConfidence': 500,
             'preferredDomain': '',
             'ignorePatterns': '',
@@ -1140,28 +2498,52 @@ class Main:
             'proxyListUrl': helpers.getFile('resources/resource')
         }
 
-        if '--debug' in sys.argv:
-            self.options['secondsBetweenItems'] = 0
-
         # read the options file
         helpers.setOptions('options.ini', self.options)
 
         self.options['ignorePatterns'] = self.options['ignorePatterns'].split(',')
         self.options['ignoreDomains'] = self.options['ignoreDomains'].split(',')
 
-        self.domainFinder = DomainFinder(self.options)
+        # how fast requests can go to each host through each proxy
+        self.rateLimits = {
+            'google.': '20/60, 3'
+        }
 
-        self.items = helpers.getCsvFileAsDictionary(self.options['inputFile'])
+        helpers.setOptions('options.ini', self.rateLimits, 'rateLimits')
 
-        self.deleteResultsToAvoid()
+        ratelimit.limiter.configure(self.rateLimits)
+
+        # how much each check adds to the confidence. the defaults are in DomainFinder.
+        self.options['weights'] = {}
+
+        helpers.setOptions('options.ini', self.options['weights'], 'weights')
+
+        self.startMetrics(logFileNameSuffix)
+
+        self.startReplay(logFileNameSuffix)
 
-        if not '--debug' in sys.argv:
-            random.shuffle(self.items)
+        self.domainFinder = DomainFinder(self.options, self.database)
+
+        self.writer = None
+
+        if self.options['writeBatchSize'] > 1:
+            self.writer = BatchWriter('database.sqlite', self.options['writeBatchSize'], self.options['writeBatchMilliseconds'])
+
+        self.items = CsvItemSource(self.options['inputFile'])
+
+        self.deleteResultsToAvoid()
 
         if '--combine' in sys.argv:
             self.combine()
             exit()
 
+        if '--rescore' in sys.argv:
+            self.rescore()
+            exit()
+
+        self.createQueue()
+
 
-main = Main()
-main.run()
+if __name__ == '__main__':
+    main = Main()
+    main.run()
@@ -13,65 +13,257 @@ import traceback
 import urllib.parse
 from collections import OrderedDict
 from . import helpers
+from . import sessions
+from . import cache
+from . import ratelimit
+from . import replay
+
+# each one is called after a request goes out with the proxies it used, how many seconds it took and whether it worked
+requestListeners = []
+
+# async requests that are on their way, by cache key
+requestsInProgress = {}
 
 class Api:
     def get(self, url, parameters=None, responseIsJson=True):
-        import requests
-
         result = ''
 
         if responseIsJson:
             result = {}
 
+        statusCode = 0
+
         try:
             logging.debug(f'Get {url}')
 
-            verify = True
-            
-            fileName = ''
-            
+            verify = self.shouldVerify(self.proxies)
+
+            fullUrl = self.urlPrefix + url
+
             if '--debug' in sys.argv:
                 logging.debug(f'Request headers: {self.headers}')
 
-                if self.proxies and 'localhost:' in self.proxies.get('http', ''):
-                    verify = False
+            text, statusCode = self.getStored('GET', fullUrl, parameters)
 
-                fileName = self.getCacheFileName(url, parameters, responseIsJson)
+            if text is None:
+                # reuses the connection to this host through this proxy when possible
+                session = sessions.pool.get(self.proxies, fullUrl)
 
-                if not '--noCache' in sys.argv and os.path.exists(fileName):
-                    logging.info('Using cached version')
-                    result = helpers.getFile(fileName)
+                ratelimit.limiter.wait(fullUrl, self.proxies)
 
-                    if responseIsJson:
-                        result = json.loads(result)
+                with RequestMeasurement(self.proxies) as measurement:
+                    response = session.get(fullUrl, params=parameters, headers=self.headers, proxies=self.proxies, timeout=15, verify=verify)
+                    measurement.statusCode = response.status_code
 
-            response = requests.get(self.urlPrefix + url, params=parameters, headers=self.headers, proxies=self.proxies, timeout=15, verify=verify)
+                text = response.text
+                statusCode = response.status_code
 
-            if '--debug' in sys.argv and response and response.content:
-                logging.debug(f'Response headers: {response.headers}')
-                logging.debug(f'Response: {response.text[0:500]}...')
-                
-                if not ('maps.google' in self.urlPrefix and 'INVALID_REQUEST' in response.text):
-                    helpers.toBinaryFile(response.content, fileName)
-                    helpers.appendToFile(f'{fileName} {url}', 'logs/cache.txt')
+                self.writeToCache(fullUrl, parameters, response.status_code, response.headers, text)
 
-            if responseIsJson:
-                result = json.loads(response.text)
-            else:
-                result = response.text
+            # an empty answer is a failed request
+            if responseIsJson and text:
+                result = json.loads(text)
+            elif not responseIsJson:
+                result = text
         
         except Exception as e:
             logging.error(f'Something went wrong: {e}')
             logging.debug(traceback.format_exc())
+
+        self.statusCode = statusCode
         
         return result
 
+    async def getAsync(self, url, parameters=None, responseIsJson=True, proxies=None):
+        result = ''
+
+        if responseIsJson:
+            result = {}
+
+        # lets concurrent requests share this object but use different proxies
+        if proxies is None:
+            proxies = self.proxies
+
+        shared = False
+        statusCode = 0
+
+        try:
+            logging.debug(f'Get {url}')
+
+            verify = self.shouldVerify(proxies)
+
+            fullUrl = self.urlPrefix + url
+
+            if '--debug' in sys.argv:
+                logging.debug(f'Request headers: {self.headers}')
+
+            text, statusCode = await self.getStoredAsync('GET', fullUrl, parameters)
+
+            if text is None:
+                # the same request might already be on its way for another candidate or item
+                key = cache.responses.getKey('GET', fullUrl, parameters)
+
+                shared = key in requestsInProgress
+
+                text, statusCode = await self.joinRequestAsync(key, lambda: self.downloadAsync(fullUrl, parameters, proxies, verify))
+
+            # an empty answer is a failed request
+            if responseIsJson and text:
+                result = json.loads(text)
+            elif not responseIsJson:
+                result = text
+
+        except Exception as e:
+            logging.error(f'Something went wrong: {e}')
+            logging.debug(traceback.format_exc())
+
+        # no await after this point, so callers can read these right after their own await
+        self.sharedRequest = shared
+        self.statusCode = statusCode
+
+        return result
+
+    async def downloadAsync(self, fullUrl, parameters, proxies, verify):
+        import asyncio
+        import aiohttp
+
+        session = await sessions.getAsyncSession()
+
+        proxy = sessions.getProxyForUrl(fullUrl, proxies)
+        timeout = aiohttp.ClientTimeout(total=15)
+
+        await ratelimit.limiter.waitAsync(fullUrl, proxies)
+
+        with RequestMeasurement(proxies) as measurement:
+            async with session.get(fullUrl, params=parameters, headers=self.headers, proxy=proxy, timeout=timeout, ssl=verify) as response:
+                text = await response.text(errors='replace')
+                measurement.statusCode = response.status
+
+        await asyncio.to_thread(self.writeToCache, fullUrl, parameters, response.status, response.headers, text)
+
+        return text, response.status
+
+    # runs a request once however many callers ask for it at the same time. they all get its answer.
+    async def joinRequestAsync(self, key, function):
+        import asyncio
+
+        task = requestsInProgress.get(key, None)
+
+        if not task:
+            task = asyncio.ensure_future(function())
+
+            requestsInProgress[key] = task
+
+            def onDone(task):
+                if requestsInProgress.get(key, None) is task:
+                    del requestsInProgress[key]
+
+                # the callers might all have been cancelled
+                if not task.cancelled():
+                    task.exception()
+
+            task.add_done_callback(onDone)
+
+        # a caller that's cancelled doesn't cancel the request for the others
+        return await asyncio.shield(task)
+
+    async def getPlainAsync(self, url, proxies=None):
+        return await self.getAsync(url, None, False, proxies)
+
+    # only downloads the page until it contains stopAt or has maximumBytes, then closes the connection
+    def getStart(self, url, stopAt, maximumBytes):
+        result = ''
+        statusCode = 0
+
+        try:
+            logging.debug(f'Get start of {url}')
+
+            fullUrl = self.urlPrefix + url
+
+            text, statusCode = self.getStored('PARTIAL', fullUrl, None)
+
+            if text is None:
+                session = sessions.pool.get(self.proxies, fullUrl)
+
+                ratelimit.limiter.wait(fullUrl, self.proxies)
+
+                with RequestMeasurement(self.proxies) as measurement, session.get(fullUrl, headers=self.headers, proxies=self.proxies, timeout=15, verify=self.shouldVerify(self.proxies), stream=True) as response:
+                    measurement.statusCode = response.status_code
+
+                    reader = PartialReader(stopAt, maximumBytes)
+
+                    for chunk in response.iter_content(chunk_size=4096):
+                        if reader.add(chunk):
+                            break
+
+                    text = reader.getText(response.encoding)
+                    statusCode = response.status_code
+
+                    self.writePartialToCache(fullUrl, response.status_code, response.headers, text)
+
+            result = text
+        except Exception as e:
+            logging.error(f'Something went wrong: {e}')
+            logging.debug(traceback.format_exc())
+
+        self.statusCode = statusCode
+
+        return result
+
+    async def getStartAsync(self, url, stopAt, maximumBytes, proxies=None):
+        import asyncio
+        import aiohttp
+
+        result = ''
+        statusCode = 0
+
+        if proxies is None:
+            proxies = self.proxies
+
+        try:
+            logging.debug(f'Get start of {url}')
+
+            fullUrl = self.urlPrefix + url
+
+            text, statusCode = await self.getStoredAsync('PARTIAL', fullUrl, None)
+
+            if text is None:
+                session = await sessions.getAsyncSession()
+
+                proxy = sessions.getProxyForUrl(fullUrl, proxies)
+                timeout = aiohttp.ClientTimeout(total=15)
+
+                await ratelimit.limiter.waitAsync(fullUrl, proxies)
+
+                with RequestMeasurement(proxies) as measurement:
+                    async with session.get(fullUrl, headers=self.headers, proxy=proxy, timeout=timeout, ssl=self.shouldVerify(proxies)) as response:
+                        measurement.statusCode = response.status
+
+                        reader = PartialReader(stopAt, maximumBytes)
+
+                        async for chunk in response.content.iter_chunked(4096):
+                            if reader.add(chunk):
+                                break
+
+                        text = reader.getText(response.charset)
+                        statusCode = response.status
+
+                await asyncio.to_thread(self.writePartialToCache, fullUrl, response.status, response.headers, text)
+
+            result = text
+        except Exception as e:
+            logging.error(f'Something went wrong: {e}')
+            logging.debug(traceback.format_exc())
+
+        # no await after this point
+        self.statusCode = statusCode
+
+        return result
+
     def getPlain(self, url):
         return self.get(url, None, False)
 
     def post(self, url, data, responseIsJson=True):
-        import requests
-        
         result = {}
 
         if not responseIsJson:
@@ -80,26 +272,31 @@ class Api:
         try:
             logging.debug(f'Post {url}')
 
-            verify = True
-            
-            fileName = ''
+            verify = self.shouldVerify(self.proxies)
             
             if '--debug' in sys.argv:
                 logging.debug(f'Request headers: {self.headers}')
                 logging.debug(f'Request body: {data}')
-                
-                if self.proxies and 'localhost:' in self.proxies.get('http', ''):
-                    verify = False
-                
-                # don't want to read files for post, just write them
-                fileName = self.getCacheFileName(url, {}, responseIsJson)
 
-            response = requests.post(self.urlPrefix + url, headers=self.headers, proxies=self.proxies, data=data, timeout=15, verify=verify)
+            fullUrl = self.urlPrefix + url
+
+            # nothing goes to the network when replaying
+            if replay.store.isReplaying():
+                logging.debug(f'Not sending {fullUrl} while replaying')
+                return result
+
+            session = sessions.pool.get(self.proxies, fullUrl)
 
-            if '--debug' in sys.argv and response and response.content:
+            ratelimit.limiter.wait(fullUrl, self.proxies)
+
+            with RequestMeasurement(self.proxies) as measurement:
+                response = session.post(fullUrl, headers=self.headers, proxies=self.proxies, data=data, timeout=15, verify=verify)
+                measurement.statusCode = response.status_code
+
+            # posts change things, so they're never cached
+            if '--debug' in sys.argv:
                 logging.debug(f'Response headers: {response.headers}')
                 logging.debug(f'Response: {response.text[0:500]}...')
-                helpers.toBinaryFile(response.content, fileName)
 
             if responseIsJson:
                 result = json.loads(response.text)
@@ -111,42 +308,131 @@ class Api:
 
         return result
 
-    def getCacheFileName(self, url, parameters, responseIsJson):
-        result = ''
+    async def postAsync(self, url, data, responseIsJson=True, proxies=None):
+        import aiohttp
+
+        result = {}
 
-        file = helpers.getFile('logs/cache.txt')
+        if not responseIsJson:
+            result = ''
 
-        urlToFind = url
-       
-        if parameters:
-            urlToFind += '?' + urllib.parse.urlencode(parameters)
+        if proxies is None:
+            proxies = self.proxies
 
-        for line in file.splitlines():
-            fileName = helpers.findBetween(line, '', ' ')
-            lineUrl = helpers.findBetween(line, ' ', '')
+        try:
+            logging.debug(f'Post {url}')
 
-            if lineUrl == urlToFind:
-                result = fileName
-                break
+            verify = self.shouldVerify(proxies)
 
-        if not result:
-            fileName = helpers.lettersAndNumbersOnly(url)
-            fileName = fileName[0:25]
-            
-            for i in range(0, 16):  
-                fileName += str(random.randrange(0, 10))
-            
-            extension = 'json'
+            if '--debug' in sys.argv:
+                logging.debug(f'Request headers: {self.headers}')
+                logging.debug(f'Request body: {data}')
+
+            fullUrl = self.urlPrefix + url
 
-            if not responseIsJson:
-                extension = 'html'
+            # nothing goes to the network when replaying
+            if replay.store.isReplaying():
+                logging.debug(f'Not sending {fullUrl} while replaying')
+                return result
 
-            result = f'logs/cache/{fileName}.{extension}'
+            session = await sessions.getAsyncSession()
 
-        helpers.makeDirectory('logs/cache')
+            proxy = sessions.getProxyForUrl(fullUrl, proxies)
+            timeout = aiohttp.ClientTimeout(total=15)
+
+            await ratelimit.limiter.waitAsync(fullUrl, proxies)
+
+            with RequestMeasurement(proxies) as measurement:
+                async with session.post(fullUrl, headers=self.headers, proxy=proxy, data=data, timeout=timeout, ssl=verify) as response:
+                    text = await response.text(errors='replace')
+                    measurement.statusCode = response.status
+
+            if '--debug' in sys.argv:
+                logging.debug(f'Response headers: {response.headers}')
+                logging.debug(f'Response: {text[0:500]}...')
+
+            if responseIsJson:
+                result = json.loads(text)
+            else:
+                result = text
+        except Exception as e:
+            logging.error(f'Something went wrong: {e}')
+            logging.debug(traceback.format_exc())
 
         return result
 
+    def shouldVerify(self, proxies):
+        result = True
+
+        # debugging proxies on localhost use their own certificates
+        if '--debug' in sys.argv and proxies and 'localhost:' in proxies.get('http', ''):
+            result = False
+
+        return result
+
+    # answers from the replay store when replaying, otherwise from the cache. returns the text and status code. the text is None when it has to be downloaded.
+    def getStored(self, method, url, parameters):
+        if not self.useCache:
+            # nothing goes to the network when replaying
+            if replay.store.isReplaying():
+                return '', 0
+
+            return None, 0
+
+        if replay.store.isReplaying():
+            return replay.store.getResponse(method, url, parameters)
+
+        text = cache.responses.get(method, url, parameters)
+
+        if text is None:
+            return None, 0
+
+        # so the recording has everything the run needed
+        replay.store.record(method, url, parameters, 200, '', text)
+
+        # only successful responses are cached
+        return text, 200
+
+    # the cache and replay store are sqlite files, so they're read on another thread instead of holding up the event loop
+    async def getStoredAsync(self, method, url, parameters):
+        import asyncio
+
+        return await asyncio.to_thread(self.getStored, method, url, parameters)
+
+    def writeToCache(self, url, parameters, statusCode, headers, text):
+        if '--debug' in sys.argv:
+            logging.debug(f'Response headers: {headers}')
+            logging.debug(f'Response: {text[0:500]}...')
+
+        if not self.useCache:
+            return
+
+        replay.store.record('GET', url, parameters, statusCode, headers.get('content-type', ''), text)
+
+        # errors and rate limit pages shouldn't be served again later
+        if statusCode < 200 or statusCode >= 300:
+            return
+
+        if 'maps.google' in self.urlPrefix and 'INVALID_REQUEST' in text:
+            return
+
+        cache.responses.put('GET', url, parameters, headers.get('content-type', ''), text)
+
+    def writePartialToCache(self, url, statusCode, headers, text):
+        if not self.useCache:
+            return
+
+        replay.store.record('PARTIAL', url, None, statusCode, headers.get('content-type', ''), text)
+
+        if statusCode < 200 or statusCode >= 300:
+            return
+
+        # kept apart from full responses for the same url
+        cache.responses.put('PARTIAL', url, None, headers.get('content-type', ''), text)
+
+    def removeFromCache(self, url, parameters=None):
+        cache.responses.remove('GET', self.urlPrefix + url, parameters)
+
     def getHeadersFromTextFile(self, fileName):
         result = OrderedDict()
 
@@ -247,8 +533,10 @@ class Api:
 
         self.headers = self.getHeadersFromFile(f'resources/headers-{number}.txt')
 
-    def __init__(self, urlPrefix):
+    # useCache=False is for answers that change over time, like the proxy list. they're never cached or recorded.
+    def __init__(self, urlPrefix, useCache=True):
         self.urlPrefix = urlPrefix
+        self.useCache = useCache
 
         self.randomizeHeaders()
 
@@ -266,6 +554,10 @@ class Api:
             ])
 
         self.proxies = None
+        # whether the last async get joined a request that was already on its way
+        self.sharedRequest = False
+        # of the last get. 0 if it failed before getting an answer.
+        self.statusCode = 0
 
         try:
             import brotli
@@ -274,4 +566,59 @@ class Api:
             logging.error(f'You need to run "pip3 install brotlipy" or "pip install brotlipy" first, then restart this script')
             logging.debug(traceback.format_exc())
             input("Press enter to exit...")
-            exit()
\ No newline at end of file
+            exit()
+
+# times a request and tells the request listeners how it went
+class RequestMeasurement:
+    def __enter__(self):
+        self.started = time.time()
+
+        return self
+
+    def __exit__(self, exceptionType, exception, traceback):
+        seconds = time.time() - self.started
+
+        # blocked, rate limited or broken. a page that doesn't exist still went through fine.
+        succeeded = exceptionType is None and self.statusCode < 500 and not self.statusCode in [403, 407, 429]
+
+        for listener in requestListeners:
+            try:
+                listener(self.proxies, seconds, succeeded)
+            except Exception as e:
+                logging.debug(e)
+
+        return False
+
+    def __init__(self, proxies):
+        self.proxies = proxies
+        self.statusCode = 0
+        self.started = 0
+
+class PartialReader:
+    # returns true when it has enough
+    def add(self, chunk):
+        self.content += chunk
+
+        # the end marker could be split between two chunks
+        start = max(0, self.searchFrom - len(self.stopAt))
+        self.searchFrom = len(self.content)
+
+        if self.stopAt in self.content[start:].lower():
+            return True
+
+        return len(self.content) >= self.maximumBytes
+
+    def getText(self, encoding):
+        if not encoding:
+            encoding = 'utf-8'
+
+        try:
+            return self.content.decode(encoding, errors='replace')
+        except LookupError:
+            return self.content.decode('utf-8', errors='replace')
+
+    def __init__(self, stopAt, maximumBytes):
+        self.stopAt = stopAt.lower().encode('utf-8')
+        self.maximumBytes = maximumBytes
+        self.content = b''
+        self.searchFrom = 0
@@ -0,0 +1,210 @@
+import sqlite3
+import logging
+import os
+import threading
+import time
+import hashlib
+import urllib.parse
+import traceback
+from . import helpers
+from . import metrics
+
+class ResponseCache:
+    def get(self, method, url, parameters):
+        result = None
+
+        if not self.isEnabled():
+            return result
+
+        key = self.getKey(method, url, parameters)
+
+        try:
+            with self.lock:
+                self.open()
+
+                now = time.time()
+
+                row = self.connection.execute('select body, expires, lastUsed from responses where key = ?', (key,)).fetchone()
+
+                if row and row[1] >= now:
+                    result = row[0]
+
+                    # eviction only needs a rough order, so a read doesn't have to be a write every time
+                    if (row[2] or 0) < now - self.lastUsedSeconds:
+                        self.connection.execute('update responses set lastUsed = ? where key = ?', (now, key))
+                        self.connection.commit()
+        except Exception as e:
+            logging.error(f'Cache error: {e}')
+            logging.debug(traceback.format_exc())
+
+        if result is None:
+            self.misses += 1
+        else:
+            logging.debug(f'Using cached version of {url}')
+            self.hits += 1
+
+        return result
+
+    def put(self, method, url, parameters, contentType, body):
+        if not self.isEnabled() or not body:
+            return
+
+        hours = self.getHours(contentType)
+
+        if hours <= 0:
+            return
+
+        key = self.getKey(method, url, parameters)
+
+        try:
+            with self.lock:
+                self.open()
+
+                now = time.time()
+                size = len(body.encode('utf-8'))
+
+                self.connection.execute('insert or replace into responses (key, method, url, contentType, body, size, created, expires, lastUsed) values (?, ?, ?, ?, ?, ?, ?, ?, ?)', (key, method, url, contentType, body, size, now, now + hours * 60 * 60, now))
+                self.connection.commit()
+
+                self.totalSize += size
+                self.writesSinceSizeCheck += 1
+
+                self.evictIfNeeded()
+        except Exception as e:
+            logging.error(f'Cache error: {e}')
+            logging.debug(traceback.format_exc())
+
+    def remove(self, method, url, parameters):
+        if not self.isEnabled():
+            return
+
+        key = self.getKey(method, url, parameters)
+
+        try:
+            with self.lock:
+                self.open()
+
+                self.connection.execute('delete from responses where key = ?', (key,))
+                self.connection.commit()
+        except Exception as e:
+            logging.error(f'Cache error: {e}')
+
+    def getKey(self, method, url, parameters):
+        toHash = method.upper() + ' ' + url
+
+        if parameters:
+            # same request in a different order is the same request
+            toHash += '?' + urllib.parse.urlencode(sorted(parameters.items()))
+
+        return hashlib.sha1(toHash.encode('utf-8')).hexdigest()
+
+    def getHours(self, contentType):
+        contentType = contentType.lower()
+
+        if 'html' in contentType:
+            return self.hoursHtml
+        elif 'json' in contentType or 'javascript' in contentType:
+            return self.hoursJson
+
+        return self.hoursOther
+
+    def evictIfNeeded(self):
+        maximumBytes = self.maximumMegabytes * 1000 * 1000
+
+        # other processes write to the same file, so recount once in a while
+        if self.writesSinceSizeCheck >= 100:
+            self.writesSinceSizeCheck = 0
+            self.totalSize = self.getTotalSize()
+
+        if self.totalSize <= maximumBytes:
+            return
+
+        # leave some room so it doesn't evict on every write
+        target = maximumBytes * 0.9
+
+        logging.debug(f'Cache is {self.totalSize} bytes. Evicting least recently used responses.')
+
+        self.connection.execute('delete from responses where expires < ?', (time.time(),))
+
+        self.totalSize = self.getTotalSize()
+
+        while self.totalSize > target:
+            rows = self.connection.execute('select key, size from responses order by lastUsed limit 100').fetchall()
+
+            if not rows:
+                break
+
+            self.connection.executemany('delete from responses where key = ?', [(row[0],) for row in rows])
+
+            self.evictions += len(rows)
+            self.totalSize -= sum(row[1] for row in rows)
+
+        self.connection.commit()
+
+    def getTotalSize(self):
+        row = self.connection.execute('select sum(size) from responses').fetchone()
+
+        if not row or not row[0]:
+            return 0
+
+        return row[0]
+
+    def getStatistics(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+    def isEnabled(self):
+        import sys
+
+        return self.fileName and not '--noCache' in sys.argv
+
+    def open(self):
+        if self.connection:
+            return
+
+        helpers.makeDirectory(os.path.dirname(self.fileName) or '.')
+
+        self.connection = sqlite3.connect(self.fileName, timeout=30, check_same_thread=False)
+        self.connection.execute('pragma journal_mode=wal')
+        # with wal this can't corrupt the file. a crash can only lose the last few responses.
+        self.connection.execute('pragma synchronous=normal')
+        self.connection.execute('create table if not exists responses ( key text, method text, url text, contentType text, body text, size integer, created real, expires real, lastUsed real, primary key(key) )')
+        self.connection.execute('create index if not exists responsesLastUsed on responses (lastUsed)')
+        self.connection.commit()
+
+        self.totalSize = self.getTotalSize()
+
+    def close(self):
+        with self.lock:
+            if self.connection:
+                self.connection.close()
+                self.connection = None
+
+    def configure(self, options):
+        self.fileName = options.get('cacheFile', self.fileName)
+        self.maximumMegabytes = int(options.get('cacheMaximumMegabytes', self.maximumMegabytes))
+        self.hoursHtml = int(options.get('cacheHoursHtml', self.hoursHtml))
+        self.hoursJson = int(options.get('cacheHoursJson', self.hoursJson))
+        self.hoursOther = int(options.get('cacheHoursOther', self.hoursOther))
+
+    def __init__(self):
+        self.fileName = 'logs/cache.sqlite'
+        self.maximumMegabytes = 500
+        self.hoursHtml = 168
+        self.hoursJson = 24
+        self.hoursOther = 24
+        self.lastUsedSeconds = 60 * 60
+        self.connection = None
+        self.lock = threading.Lock()
+        self.totalSize = 0
+        self.writesSinceSizeCheck = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+responses = ResponseCache()
+
+metrics.registry.addGauges(responses.getStatistics, 'cache_')
@@ -8,6 +8,9 @@ import sqlite3
 import logging
 import time
 import random
+import threading
+import queue
+from . import metrics
 
 ###########################################################################
 #
@@ -70,11 +73,17 @@ class Database:
     def open(self,name):
         
         try:
-            self.conn = sqlite3.connect(name);
+            # sqlite waits for the lock itself before giving up
+            # the async engine uses it from the thread in runAsync
+            self.conn = sqlite3.connect(name, timeout=30, check_same_thread=False);
             # to get column names
             self.conn.row_factory = sqlite3.Row 
             self.cursor = self.conn.cursor()
 
+            # readers don't block the writer and the writer doesn't block readers
+            self.cursor.execute('pragma journal_mode=wal')
+            self.cursor.execute('pragma synchronous=normal')
+
         except sqlite3.Error as e:
             print("Error connecting to database!")
 
@@ -125,9 +134,11 @@ class Database:
     #
     #  @param limit Optionally, a limit of items to fetch.
     #
+    #  @param parameters Optionally, values for the ? placeholders in where.
+    #
     #######################################################################
 
-    def get(self,table,columns,where,orderBy,orderType,limit=None):
+    def get(self,table,columns,where,orderBy,orderType,limit=None,parameters=()):
         result = []
         
         try:
@@ -146,7 +157,7 @@ class Database:
 
             query = f"SELECT {columns} from {table}{wherePart}{orderByPart}{limitPart};"
             
-            self.executeWithRetries(query)
+            self.executeWithRetries(query, parameters, False)
 
             rows = self.cursor.fetchall()
             for row in rows:
@@ -154,14 +165,12 @@ class Database:
         except Exception as e:
             logging.error(e)
 
-        self.conn.commit()
-
         return result
 
-    def getFirst(self,table,columns,where,orderBy,orderType):
+    def getFirst(self,table,columns,where,orderBy,orderType,parameters=()):
         result = {}
 
-        rows = self.get(table, columns, where, orderBy, orderType, 1)
+        rows = self.get(table, columns, where, orderBy, orderType, 1, parameters)
 
         if len(rows) > 0:
             result = rows[0]
@@ -226,12 +235,15 @@ class Database:
             logging.error(e)
 
 
-    def executeWithRetries(self, query):
+    def executeWithRetries(self, query, parameters=(), commit=True, many=False):
         maximumTries = 1000
 
         for i in range(0, maximumTries):        
             try:
-                self.cursor.execute(query)
+                if many:
+                    self.cursor.executemany(query, parameters)
+                else:
+                    self.cursor.execute(query, parameters)
                 
                 # if it's here it means it succeeded
                 break
@@ -247,42 +259,53 @@ class Database:
                     logging.error(e)
                     break
         
-        self.conn.commit()
+        if commit:
+            self.conn.commit()
 
     def insert(self, table, item):
-        try:
-            logging.debug(f'Inserting into database: {item}')
+        logging.debug(f'Inserting into database: {item}')
 
-            if not item:
-                return
+        self.insertMany(table, [item])
+
+    #######################################################################
+    #
+    ## Function to write several rows in one transaction.
+    #
+    #  The rows can have different columns. Rows with the same columns
+    #  share one prepared statement.
+    #
+    #  @param table The name of the database's table to write to.
+    #
+    #  @param items A list of dictionaries of column names and values.
+    #
+    #######################################################################
 
-            columns = ''
-            data = ''
+    def insertMany(self, table, items):
+        try:
+            groups = {}
 
-            i = 0
+            for item in items:
+                if not item:
+                    continue
 
-            keys = item.keys()
-            for key in keys:
-                columns += key
+                columns = tuple(item.keys())
 
-                value = item[key]
+                groups.setdefault(columns, []).append(tuple(item.values()))
 
-                if isinstance(value, str):
-                    value = "'" + value.replace("'", "''") + "'"
-                elif value == None:
-                    value = 'null'
-                
-                data += str(value)
+            if not groups:
+                return
 
-                if i < len(keys) - 1:
-                    columns += ', '
-                    data += ', '                    
+            with metrics.registry.time('database_write_seconds', {'table': table}):
+                for columns, rows in groups.items():
+                    placeholders = ', '.join(['?'] * len(columns))
 
-                i += 1
+                    query = "INSERT OR REPLACE INTO {0} ({1}) VALUES ({2});".format(table, ', '.join(columns), placeholders)
 
-            query = "INSERT OR REPLACE INTO {0} ({1}) VALUES ({2});".format(table,columns,data)
+                    self.executeWithRetries(query, rows, False, True)
 
-            self.executeWithRetries(query)
+                    metrics.registry.increment('database_rows_written_total', {'table': table}, len(rows))
+
+                self.conn.commit()
         except Exception as e:
             logging.error(f'Database error:')
             logging.error(e)
@@ -296,10 +319,37 @@ class Database:
     #
     #  @param sql A valid SQL statement in string format.
     #
+    #  @param parameters Optionally, values for the ? placeholders.
+    #
+    #######################################################################
+
+    def execute(self, statement, parameters=()):
+        self.executeWithRetries(statement, parameters)
+
+    def executeMany(self, statement, rows):
+        self.executeWithRetries(statement, rows, True, True)
+
+    #######################################################################
+    #
+    ## Function to go through the results of a query one row at a time.
+    #
+    #  Unlike get(), the rows aren't all loaded into memory at once.
+    #
+    #  @param sql A valid SQL statement in string format.
+    #
+    #  @param parameters Optionally, values for the ? placeholders.
+    #
     #######################################################################
 
-    def execute(self, statement):
-        self.executeWithRetries(statement)
+    def iterate(self, sql, parameters=()):
+        cursor = self.conn.cursor()
+
+        cursor.execute(sql, parameters)
+
+        for row in cursor:
+            yield dict(row)
+
+        cursor.close()
 
     def query(self,sql):
         self.cursor.execute(sql)
@@ -344,3 +394,114 @@ class Database:
             ret.append(((hi,hi_t),(lo,lo_t),avg))
 
         return ret
+
+
+###########################################################################
+#
+##   Writes rows from a background thread.
+#
+#    Rows are grouped into one transaction every maximumRows rows or
+#    maximumMilliseconds milliseconds, whichever comes first. That way
+#    many processes writing to the same database spend less time waiting
+#    for each other's locks. The thread has its own connection.
+#
+###########################################################################
+
+class BatchWriter:
+
+    def insert(self, table, item):
+        self.queue.put((table, item))
+
+    def run(self):
+        database = Database(self.name)
+
+        finished = False
+
+        while not finished:
+            rows = []
+
+            deadline = None
+
+            # wait for the first row, then collect more until the batch is full or time is up
+            while len(rows) < self.maximumRows:
+                timeout = None
+
+                if rows:
+                    timeout = deadline - time.time()
+
+                    if timeout <= 0:
+                        break
+
+                try:
+                    row = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+
+                if row is None:
+                    finished = True
+                    break
+
+                rows.append(row)
+
+                if not deadline:
+                    deadline = time.time() + self.maximumMilliseconds / 1000
+
+            self.write(database, rows)
+
+        database.close()
+
+    def write(self, database, rows):
+        if not rows:
+            return
+
+        logging.debug(f'Writing {len(rows)} rows to the database')
+
+        tables = {}
+
+        for table, item in rows:
+            tables.setdefault(table, []).append(item)
+
+        for table, items in tables.items():
+            database.insertMany(table, items)
+
+    #######################################################################
+    #
+    ## Writes what's left and stops the thread.
+    #
+    #######################################################################
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def __init__(self, name, maximumRows=100, maximumMilliseconds=1000):
+        self.name = name
+        self.maximumRows = maximumRows
+        self.maximumMilliseconds = maximumMilliseconds
+        self.queue = queue.Queue()
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+
+###########################################################################
+#
+##   Runs blocking database and file work for the async engine.
+#
+#    Everything goes through one thread, so it doesn't hold up the event
+#    loop and a connection is never used by two threads at the same time.
+#
+###########################################################################
+
+executor = None
+
+async def runAsync(function, *arguments):
+    import asyncio
+    import concurrent.futures
+
+    global executor
+
+    if not executor:
+        executor = concurrent.futures.ThreadPoolExecutor(1, 'database')
+
+    return await asyncio.get_running_loop().run_in_executor(executor, function, *arguments)
@@ -64,6 +64,53 @@ def substringIsInList(list, s):
 
     return result
 
+class PatternMatcher:
+    def getMatch(self, s):
+        if not self.expression:
+            return None
+
+        match = self.expression.search(s)
+
+        if not match:
+            return None
+
+        # the pattern that was found
+        return match.group(0)
+
+    def __init__(self, list):
+        import re
+
+        self.expression = None
+
+        if not list:
+            return
+
+        # longest first, so the most specific pattern is reported
+        patterns = sorted(set(list), key=len, reverse=True)
+
+        self.expression = re.compile('|'.join(re.escape(pattern) for pattern in patterns))
+
+class DomainMatcher:
+    def getMatch(self, domain):
+        if domain in self.domains:
+            return domain
+
+        # try every suffix that starts after a dot. "a.b.co.uk" tries "b.co.uk", "co.uk" then "uk".
+        index = domain.find('.')
+
+        while index != -1:
+            suffix = domain[index + 1:]
+
+            if suffix in self.domains:
+                return suffix
+
+            index = domain.find('.', index + 1)
+
+        return None
+
+    def __init__(self, list):
+        self.domains = set(list)
+
 def numbersOnly(s):
     return ''.join(filter(lambda x: x.isdigit(), s))
 
@@ -140,7 +187,7 @@ def stringToFloatingPoint(s):
 def getCsvFile(fileName):
     result = []
 
-    with open('input.csv') as inputFile:
+    with open(fileName) as inputFile:
         csvReader = csv.reader(inputFile, delimiter=',')
             
         # skip the headers
@@ -200,8 +247,9 @@ def getUrl(url):
     response = ''
 
     try:
-        import requests
-        response = requests.get(url)
+        from . import sessions
+        session = sessions.pool.get(None, url)
+        response = session.get(url)
     except Exception as e:
         logging.error(e)
         return ''
@@ -405,21 +453,63 @@ def fileNameOnly(fileName, includeExtension):
 
 class Downloader:
     def get(self, url, params=None):
-        import requests
+        from . import sessions
+        from . import replay
 
         result = ''
 
         try:
             logging.debug(f'Getting {url}')
-            response = requests.get(url, params=params, headers=self.headers, proxies=self.proxies, timeout=15)
+
+            if replay.store.isReplaying():
+                return replay.store.get('GET', url, params)
+
+            session = sessions.pool.get(self.proxies, url)
+            response = session.get(url, params=params, headers=self.headers, proxies=self.proxies, timeout=15)
             response.encoding = 'utf-8'
             result = response.text
+
+            replay.store.record('GET', url, params, response.status_code, response.headers.get('content-type', ''), result)
         except Exception as e:
             logging.error(f'Something went wrong: {e}')
             logging.debug(traceback.format_exc())                
         
         return result
 
+    async def getAsync(self, url, params=None, proxies=None):
+        import asyncio
+        import aiohttp
+        from . import sessions
+        from . import replay
+
+        result = ''
+
+        if proxies is None:
+            proxies = self.proxies
+
+        try:
+            logging.debug(f'Getting {url}')
+
+            # the store is a sqlite file, so it's used from another thread
+            if replay.store.isReplaying():
+                return await asyncio.to_thread(replay.store.get, 'GET', url, params)
+
+            session = await sessions.getAsyncSession()
+
+            proxy = sessions.getProxyForUrl(url, proxies)
+            timeout = aiohttp.ClientTimeout(total=15)
+
+            async with session.get(url, params=params, headers=self.headers, proxy=proxy, timeout=timeout) as response:
+                result = await response.text(encoding='utf-8', errors='replace')
+
+            if replay.store.isRecording():
+                await asyncio.to_thread(replay.store.record, 'GET', url, params, response.status, response.headers.get('content-type', ''), result)
+        except Exception as e:
+            logging.error(f'Something went wrong: {e}')
+            logging.debug(traceback.format_exc())
+
+        return result
+
     def downloadBinaryFile(self, url, destinationFileName):       
         result = False
         
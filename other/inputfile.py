@@ -0,0 +1,151 @@
+import os
+import io
+import csv
+import array
+import random
+import logging
+from . import helpers
+
+# reads rows from a csv file when they're needed instead of loading the whole file.
+# an index of where each row starts lets it jump straight to any row.
+class CsvItemSource:
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, row):
+        self.file.seek(self.offsets[row])
+
+        offset, text = self.readRecord()
+
+        return self.getDictionary(text)
+
+    def __iter__(self):
+        for row, item in self.iterate():
+            yield item
+
+    def iterate(self, start=0):
+        if start >= len(self.offsets):
+            return
+
+        self.file.seek(self.offsets[start])
+
+        # reads on from there without jumping around
+        for row in range(start, len(self.offsets)):
+            offset, text = self.readRecord()
+
+            yield row, self.getDictionary(text)
+
+    def getShuffledPositions(self, seed):
+        order = array.array('q', range(0, len(self.offsets)))
+
+        random.Random(seed).shuffle(order)
+
+        # where each row goes in the shuffled order
+        positions = array.array('q', bytes(8 * len(order)))
+
+        for position, row in enumerate(order):
+            positions[row] = position
+
+        return positions
+
+    def readRecord(self):
+        offset = self.file.tell()
+        lines = []
+        quotes = 0
+
+        while True:
+            line = self.file.readline()
+
+            if not line:
+                break
+
+            # skip empty lines between records
+            if not lines and not line.strip():
+                offset += len(line)
+                continue
+
+            lines.append(line)
+
+            # a quoted field can go over several lines
+            quotes += line.count(b'"')
+
+            if quotes % 2 == 0:
+                break
+
+        return offset, b''.join(lines)
+
+    def getDictionary(self, text):
+        values = self.getValues(text)
+
+        result = {}
+
+        for i, field in enumerate(self.header):
+            if i < len(values):
+                result[field] = values[i]
+            else:
+                result[field] = ''
+
+        return result
+
+    def getValues(self, text, encoding='utf-8'):
+        reader = csv.reader(io.StringIO(text.decode(encoding, errors='replace'), newline=''), delimiter=',')
+
+        return next(reader, [])
+
+    def loadIndex(self):
+        # the index is only valid for this exact version of the file
+        information = os.stat(self.fileName)
+        key = [information.st_size, information.st_mtime_ns]
+
+        self.fingerprint = f'{information.st_size}-{information.st_mtime_ns}'
+
+        if os.path.exists(self.indexFileName):
+            index = array.array('q')
+
+            with open(self.indexFileName, 'rb') as file:
+                index.frombytes(file.read())
+
+            if list(index[0:2]) == key:
+                self.offsets = index[2:]
+                return
+
+        logging.info(f'Indexing {self.fileName}')
+
+        self.offsets = array.array('q')
+
+        # the header
+        self.file.seek(0)
+        self.readRecord()
+
+        while True:
+            offset, text = self.readRecord()
+
+            if not text:
+                break
+
+            self.offsets.append(offset)
+
+        helpers.makeDirectory(os.path.dirname(self.indexFileName))
+
+        # other workers might be reading it, so replace it in one go
+        temporaryFileName = f'{self.indexFileName}.{os.getpid()}'
+
+        with open(temporaryFileName, 'wb') as file:
+            file.write(array.array('q', key).tobytes())
+            file.write(self.offsets.tobytes())
+
+        os.replace(temporaryFileName, self.indexFileName)
+
+    def close(self):
+        self.file.close()
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.indexFileName = os.path.join('logs', helpers.fileNameOnly(fileName, True) + '.index')
+        self.file = open(fileName, 'rb')
+        self.fingerprint = ''
+
+        offset, text = self.readRecord()
+        self.header = self.getValues(text, 'utf-8-sig')
+
+        self.loadIndex()
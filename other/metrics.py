@@ -0,0 +1,242 @@
+import json
+import logging
+import os
+import threading
+import time
+import traceback
+from . import helpers
+
+# seconds
+buckets = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+class Histogram:
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+
+        for i, bucket in enumerate(buckets):
+            if value <= bucket:
+                self.counts[i] += 1
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        # cumulative, like prometheus expects
+        self.counts = [0] * len(buckets)
+
+class Timer:
+    def __enter__(self):
+        self.started = time.time()
+
+        return self
+
+    def __exit__(self, exceptionType, exception, traceback):
+        self.metrics.observe(self.name, time.time() - self.started, self.labels)
+
+        return False
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.started = 0
+
+# counters and latency histograms. written to a json file now and then and/or served in prometheus text format.
+class Metrics:
+    def increment(self, name, labels=None, amount=1):
+        key = self.getKey(name, labels)
+
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, labels=None):
+        key = self.getKey(name, labels)
+
+        with self.lock:
+            histogram = self.histograms.get(key, None)
+
+            if not histogram:
+                histogram = Histogram()
+                self.histograms[key] = histogram
+
+            histogram.observe(seconds)
+
+    # use with "with". works around awaits too.
+    def time(self, name, labels=None):
+        return Timer(self, name, labels)
+
+    # for values that are kept somewhere else, like the cache statistics
+    def addGauges(self, function, prefix=''):
+        self.gaugeFunctions.append((function, prefix))
+
+    def getKey(self, name, labels):
+        if not labels:
+            return (name, ())
+
+        return (name, tuple(sorted(labels.items())))
+
+    def getGauges(self):
+        result = {}
+
+        for function, prefix in self.gaugeFunctions:
+            try:
+                for name, value in function().items():
+                    result[(prefix + name, ())] = value
+            except Exception as e:
+                logging.debug(e)
+
+        return result
+
+    def getName(self, key, suffix='', extraLabels=None):
+        name, labels = key
+
+        labels = list(labels)
+
+        if extraLabels:
+            labels += extraLabels
+
+        labelPart = ''
+
+        if labels:
+            escaped = [(label, str(value).replace('\\', '\\\\').replace('"', '\\"')) for label, value in labels]
+            labelPart = '{' + ','.join(f'{label}="{value}"' for label, value in escaped) + '}'
+
+        return f'{self.prefix}{name}{suffix}{labelPart}'
+
+    def getPrometheusText(self):
+        lines = []
+        types = {}
+
+        def addType(key, type):
+            name = self.prefix + key[0]
+
+            if not name in types:
+                types[name] = type
+                lines.append(f'# TYPE {name} {type}')
+
+        with self.lock:
+            for key, value in sorted(self.counters.items()):
+                addType(key, 'counter')
+                lines.append(f'{self.getName(key)} {value}')
+
+            for key, histogram in sorted(self.histograms.items()):
+                addType(key, 'histogram')
+
+                for bucket, count in zip(buckets, histogram.counts):
+                    lines.append(f'{self.getName(key, "_bucket", [("le", bucket)])} {count}')
+
+                lines.append(f'{self.getName(key, "_bucket", [("le", "+Inf")])} {histogram.count}')
+                lines.append(f'{self.getName(key, "_sum")} {histogram.sum}')
+                lines.append(f'{self.getName(key, "_count")} {histogram.count}')
+
+        for key, value in sorted(self.getGauges().items()):
+            addType(key, 'gauge')
+            lines.append(f'{self.getName(key)} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+    def getDictionary(self):
+        result = {
+            'time': time.time(),
+            'counters': {},
+            'histograms': {},
+            'gauges': {}
+        }
+
+        with self.lock:
+            for key, value in self.counters.items():
+                result['counters'][self.getName(key)] = value
+
+            for key, histogram in self.histograms.items():
+                result['histograms'][self.getName(key)] = {
+                    'count': histogram.count,
+                    'sum': histogram.sum,
+                    'buckets': dict(zip([str(bucket) for bucket in buckets], histogram.counts))
+                }
+
+        for key, value in self.getGauges().items():
+            result['gauges'][self.getName(key)] = value
+
+        return result
+
+    def writeJson(self):
+        if not self.fileName:
+            return
+
+        try:
+            helpers.makeDirectory(os.path.dirname(self.fileName) or '.')
+
+            # so nothing reads a half written file
+            temporaryFileName = self.fileName + '.tmp'
+
+            helpers.toFile(json.dumps(self.getDictionary(), indent=4), temporaryFileName)
+
+            os.replace(temporaryFileName, self.fileName)
+        except Exception as e:
+            logging.error(f'Failed to write metrics: {e}')
+            logging.debug(traceback.format_exc())
+
+    def writeRegularly(self):
+        while not self.stopped.wait(self.seconds):
+            self.writeJson()
+
+    def startServer(self, port):
+        import http.server
+
+        metrics = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.getPrometheusText().encode('utf-8')
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *arguments):
+                pass
+
+        try:
+            self.server = http.server.ThreadingHTTPServer(('', port), Handler)
+        except Exception as e:
+            logging.error(f'Can\'t serve metrics on port {port}: {e}')
+            return
+
+        logging.info(f'Serving metrics on http://localhost:{port}/metrics')
+
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def start(self, fileName, seconds, port):
+        self.fileName = fileName
+        self.seconds = seconds
+
+        if fileName and seconds > 0:
+            threading.Thread(target=self.writeRegularly, daemon=True).start()
+
+        if port:
+            self.startServer(port)
+
+    def stop(self):
+        self.stopped.set()
+
+        # the final numbers
+        self.writeJson()
+
+        if self.server:
+            self.server.shutdown()
+            self.server = None
+
+    def __init__(self):
+        self.prefix = 'domainfinder_'
+        self.counters = {}
+        self.histograms = {}
+        self.gaugeFunctions = []
+        self.lock = threading.Lock()
+        self.fileName = ''
+        self.seconds = 0
+        self.server = None
+        self.stopped = threading.Event()
+
+registry = Metrics()
@@ -0,0 +1,242 @@
+import logging
+import random
+import threading
+import time
+import traceback
+from . import api
+from . import sessions
+from . import metrics
+
+class ProxyHealth:
+    def __init__(self):
+        # seconds. None until the first request through it works.
+        self.latency = None
+        self.errorRate = 0.0
+        self.consecutiveErrors = 0
+        self.lastCaptcha = 0
+        self.coolUntil = 0
+
+# chooses proxies by how well they've been working. ones that are failing or got a captcha rest for a while.
+class ProxyPool:
+    def load(self, loader, refreshSeconds):
+        with self.lock:
+            if self.loader:
+                return
+
+            self.loader = loader
+
+        self.loadFirstList()
+
+        # later updates happen in the background so items don't wait for them
+        if refreshSeconds > 0:
+            self.refreshSeconds = refreshSeconds
+            self.thread = threading.Thread(target=self.refreshRegularly, daemon=True)
+            self.thread.start()
+
+    def loadFirstList(self):
+        urls = self.loader()
+
+        self.setProxies(urls)
+
+        with self.lock:
+            if urls:
+                self.retrySeconds = 0
+                return
+
+            # the provider might not be ready yet. choose() tries again after a short wait.
+            self.retrySeconds = min(self.retrySeconds * 2, self.maximumRetrySeconds) if self.retrySeconds else self.minimumRetrySeconds
+            self.retryAt = time.time() + self.retrySeconds
+
+            logging.info(f'The proxy list is empty. Trying again in {self.retrySeconds} seconds.')
+
+    def retryIfEmpty(self):
+        with self.lock:
+            if self.health or not self.loader or time.time() < self.retryAt:
+                return
+
+            # so only one caller tries
+            self.retryAt = float('inf')
+
+        try:
+            self.loadFirstList()
+        except Exception as e:
+            logging.error(f'Failed to load the proxy list: {e}')
+            logging.debug(traceback.format_exc())
+
+            with self.lock:
+                self.retryAt = time.time() + max(self.retrySeconds, self.minimumRetrySeconds)
+
+    def refreshRegularly(self):
+        while not self.stopped.wait(self.refreshSeconds):
+            try:
+                logging.debug('Refreshing the proxy list')
+
+                urls = self.loader()
+
+                # keep using the old list if the provider is having problems
+                if urls:
+                    self.setProxies(urls)
+            except Exception as e:
+                logging.error(f'Failed to refresh the proxy list: {e}')
+                logging.debug(traceback.format_exc())
+
+    def setProxies(self, urls):
+        with self.lock:
+            # what's known about proxies that are still in the list is kept
+            self.health = {url: self.health.get(url, ProxyHealth()) for url in urls}
+
+        # connections through proxies that aren't in the list anymore aren't useful
+        if urls:
+            sessions.pool.keepOnly(urls)
+
+    # returns different proxies if there are enough
+    def choose(self, count=1):
+        result = []
+
+        self.retryIfEmpty()
+
+        with self.lock:
+            if not self.health:
+                return result
+
+            now = time.time()
+
+            available = [url for url, health in self.health.items() if health.coolUntil <= now]
+
+            # better to try a resting proxy than to have none
+            if not available:
+                available = list(self.health.keys())
+
+            averageLatency = self.getAverageLatency()
+
+            weights = [self.getWeight(self.health[url], averageLatency) for url in available]
+
+            for i in range(0, count):
+                if not available:
+                    # not enough for everyone to get a different one
+                    result.append(random.choice(result))
+                    continue
+
+                index = random.choices(range(0, len(available)), weights=weights)[0]
+
+                result.append(available.pop(index))
+                weights.pop(index)
+
+        return result
+
+    def getWeight(self, health, averageLatency):
+        latency = health.latency
+
+        # new proxies get the benefit of the doubt
+        if latency is None:
+            latency = averageLatency
+
+        # every proxy keeps a small chance so it can show it's working again
+        return max((1 - health.errorRate) ** 2, 0.01) / max(latency, 0.05)
+
+    def getAverageLatency(self):
+        latencies = [health.latency for health in self.health.values() if health.latency is not None]
+
+        if not latencies:
+            return 1
+
+        return sum(latencies) / len(latencies)
+
+    def recordRequest(self, proxies, seconds, succeeded):
+        url = self.getUrl(proxies)
+
+        metrics.registry.increment('proxy_requests_total', {'proxy': self.getDescription(url), 'result': 'succeeded' if succeeded else 'failed'})
+        metrics.registry.observe('proxy_request_seconds', seconds, {'proxy': self.getDescription(url)})
+
+        with self.lock:
+            health = self.health.get(url, None)
+
+            if not health:
+                return
+
+            # recent requests count more than old ones
+            health.errorRate = health.errorRate * (1 - self.smoothing) + (0 if succeeded else 1) * self.smoothing
+
+            if succeeded:
+                health.consecutiveErrors = 0
+
+                if health.latency is None:
+                    health.latency = seconds
+                else:
+                    health.latency = health.latency * (1 - self.smoothing) + seconds * self.smoothing
+
+                return
+
+            health.consecutiveErrors += 1
+
+            if health.consecutiveErrors >= self.maximumConsecutiveErrors:
+                logging.debug(f'Resting proxy {self.getDescription(url)} for {self.errorCooldownSeconds} seconds. It failed {health.consecutiveErrors} times in a row.')
+                health.coolUntil = time.time() + self.errorCooldownSeconds
+
+    def recordCaptcha(self, proxies):
+        url = self.getUrl(proxies)
+
+        metrics.registry.increment('proxy_captchas_total', {'proxy': self.getDescription(url)})
+
+        with self.lock:
+            health = self.health.get(url, None)
+
+            if not health:
+                return
+
+            logging.info(f'Resting proxy {self.getDescription(url)} for {self.captchaCooldownSeconds} seconds because it got a captcha')
+
+            health.lastCaptcha = time.time()
+            health.coolUntil = health.lastCaptcha + self.captchaCooldownSeconds
+
+    def getStatistics(self):
+        with self.lock:
+            now = time.time()
+
+            return {
+                'proxies': len(self.health),
+                'resting': len([health for health in self.health.values() if health.coolUntil > now])
+            }
+
+    def getUrl(self, proxies):
+        if not proxies:
+            return None
+
+        return proxies.get('http', None)
+
+    def getDescription(self, url):
+        if not url:
+            return 'none'
+
+        # without the password
+        return url.split('@')[-1]
+
+    def configure(self, captchaCooldownSeconds, errorCooldownSeconds):
+        self.captchaCooldownSeconds = int(captchaCooldownSeconds)
+        self.errorCooldownSeconds = int(errorCooldownSeconds)
+
+    def stop(self):
+        self.stopped.set()
+
+    def __init__(self):
+        self.health = {}
+        self.lock = threading.Lock()
+        self.loader = None
+        self.thread = None
+        self.stopped = threading.Event()
+        self.refreshSeconds = 0
+        self.retryAt = 0
+        self.retrySeconds = 0
+        self.minimumRetrySeconds = 10
+        self.maximumRetrySeconds = 300
+        self.smoothing = 0.2
+        self.maximumConsecutiveErrors = 3
+        self.captchaCooldownSeconds = 600
+        self.errorCooldownSeconds = 60
+
+pool = ProxyPool()
+
+# hears about every request
+api.requestListeners.append(pool.recordRequest)
+
+metrics.registry.addGauges(pool.getStatistics, 'proxy_pool_')
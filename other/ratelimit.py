@@ -0,0 +1,130 @@
+import logging
+import threading
+import time
+from urllib.parse import urlparse
+
+class TokenBucket:
+    # returns how long to wait before using the token it took
+    def reserve(self):
+        with self.lock:
+            now = time.monotonic()
+
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            # below zero means others are already waiting in line
+            self.tokens -= 1
+
+            if self.tokens >= 0:
+                return 0
+
+            return -self.tokens / self.rate
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+# limits how fast requests go to each host through each proxy. a request only waits for its own host's budget.
+class RateLimiter:
+    def wait(self, url, proxies):
+        seconds = self.reserve(url, proxies)
+
+        if seconds > 0:
+            time.sleep(seconds)
+
+    async def waitAsync(self, url, proxies):
+        import asyncio
+
+        seconds = self.reserve(url, proxies)
+
+        if seconds > 0:
+            await asyncio.sleep(seconds)
+
+    def reserve(self, url, proxies):
+        result = 0
+
+        if not self.limits:
+            return result
+
+        proxy = None
+
+        if proxies:
+            proxy = proxies.get('http', None)
+
+        host = urlparse(url).netloc.lower()
+
+        pattern = self.getPattern(host)
+
+        keys = []
+
+        if pattern:
+            keys.append((pattern, proxy))
+
+        # limit for each proxy, whatever the host
+        if 'proxy' in self.limits and proxy:
+            keys.append(('proxy', proxy))
+
+        for key in keys:
+            result = max(result, self.getBucket(key).reserve())
+
+        if result > 0:
+            logging.debug(f'Waiting {result:.2f} seconds before requesting {host}')
+
+        return result
+
+    def getPattern(self, host):
+        # the most specific one
+        for pattern in self.patterns:
+            if pattern in host:
+                return pattern
+
+        return None
+
+    def getBucket(self, key):
+        with self.lock:
+            bucket = self.buckets.get(key, None)
+
+            if not bucket:
+                rate, capacity = self.limits[key[0]]
+                bucket = TokenBucket(rate, capacity)
+                self.buckets[key] = bucket
+
+            return bucket
+
+    # limits look like "20/60", meaning 20 requests per 60 seconds. ", 5" at the end allows bursts of up to 5 requests.
+    def parseLimit(self, s):
+        burst = 1
+
+        if ',' in s:
+            s, burstPart = s.split(',', 1)
+            burst = float(burstPart.strip())
+
+        requests, seconds = s.split('/', 1)
+
+        return float(requests.strip()) / float(seconds.strip()), max(burst, 1)
+
+    def configure(self, limits):
+        self.limits = {}
+        self.buckets = {}
+
+        for pattern, s in limits.items():
+            if not s:
+                continue
+
+            try:
+                self.limits[pattern.lower()] = self.parseLimit(str(s))
+            except Exception as e:
+                logging.error(f'Invalid rate limit for {pattern}: {s}. {e}')
+
+        self.patterns = sorted([pattern for pattern in self.limits if pattern != 'proxy'], key=len, reverse=True)
+
+    def __init__(self):
+        self.limits = {}
+        self.patterns = []
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+limiter = RateLimiter()
@@ -0,0 +1,119 @@
+import sqlite3
+import logging
+import os
+import threading
+import time
+import traceback
+from . import helpers
+from . import cache
+from . import metrics
+
+# records every response a run gets, so later runs can be answered from the recording without going to the network
+class ReplayStore:
+    def get(self, method, url, parameters):
+        body, statusCode = self.getResponse(method, url, parameters)
+
+        return body
+
+    # the body and status code. a miss is ('', 0).
+    def getResponse(self, method, url, parameters):
+        key = cache.responses.getKey(method, url, parameters)
+
+        row = None
+
+        try:
+            with self.lock:
+                self.open()
+
+                row = self.connection.execute('select body, statusCode from responses where key = ?', (key,)).fetchone()
+        except Exception as e:
+            logging.error(f'Replay store error: {e}')
+            logging.debug(traceback.format_exc())
+
+        if row:
+            self.hits += 1
+            return row[0], row[1] or 0
+
+        # the same as a request that failed
+        logging.info(f'Not in the replay store: {method} {url} {parameters or ""}')
+
+        self.misses += 1
+        self.missedUrls.append(f'{method} {url} {parameters or ""}'.strip())
+
+        return '', 0
+
+    def record(self, method, url, parameters, statusCode, contentType, body):
+        if not self.isRecording():
+            return
+
+        key = cache.responses.getKey(method, url, parameters)
+
+        try:
+            with self.lock:
+                self.open()
+
+                # a later try of the same request replaces an earlier one, unless that would swap a good answer for an error
+                self.connection.execute('''insert into responses (key, method, url, statusCode, contentType, body, recorded) values (?, ?, ?, ?, ?, ?, ?)
+                    on conflict(key) do update set statusCode = excluded.statusCode, contentType = excluded.contentType, body = excluded.body, recorded = excluded.recorded
+                    where excluded.statusCode between 200 and 299 or responses.statusCode not between 200 and 299''', (key, method, url, statusCode, contentType, body, time.time()))
+                self.connection.commit()
+
+                self.recorded += 1
+        except Exception as e:
+            logging.error(f'Replay store error: {e}')
+            logging.debug(traceback.format_exc())
+
+    def isReplaying(self):
+        return self.mode == 'replay'
+
+    def isRecording(self):
+        return self.mode == 'record'
+
+    def getStatistics(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'recorded': self.recorded
+        }
+
+    def open(self):
+        if self.connection:
+            return
+
+        helpers.makeDirectory(os.path.dirname(self.fileName) or '.')
+
+        self.connection = sqlite3.connect(self.fileName, timeout=30, check_same_thread=False)
+        self.connection.execute('pragma journal_mode=wal')
+        self.connection.execute('create table if not exists responses ( key text, method text, url text, statusCode integer, contentType text, body text, recorded real, primary key(key) )')
+        self.connection.commit()
+
+    def close(self, missesFileName):
+        with self.lock:
+            if self.connection:
+                self.connection.close()
+                self.connection = None
+
+        if self.missedUrls:
+            helpers.toFile('\n'.join(self.missedUrls), missesFileName)
+
+            logging.info(f'{len(self.missedUrls)} requests weren\'t in the replay store. They\'re listed in {missesFileName}.')
+
+    def start(self, mode, fileName):
+        self.mode = mode
+        self.fileName = fileName
+
+        logging.info(f'{mode.capitalize()}ing responses in {fileName}')
+
+    def __init__(self):
+        self.mode = ''
+        self.fileName = ''
+        self.connection = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+        self.missedUrls = []
+
+store = ReplayStore()
+
+metrics.registry.addGauges(store.getStatistics, 'replay_')
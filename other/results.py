@@ -0,0 +1,167 @@
+import os
+import io
+import csv
+import json
+import time
+import logging
+import threading
+import traceback
+
+# keeps the output file open and writes results in groups instead of one at a time
+class ResultSink:
+    def write(self, values):
+        with self.lock:
+            self.rows.append(values)
+
+            if len(self.rows) >= self.maximumRows:
+                self.flush()
+
+    def flush(self):
+        with self.lock:
+            self.lastFlush = time.time()
+
+            if not self.rows:
+                return
+
+            logging.debug(f'Writing {len(self.rows)} results to {self.fileName}')
+
+            self.writeRows(self.rows)
+
+            self.rows = []
+
+    # so rows don't wait in memory when results come in slowly
+    def flushRegularly(self):
+        while not self.stopped.wait(self.maximumSeconds):
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f'Failed to write results to {self.fileName}: {e}')
+                logging.debug(traceback.format_exc())
+
+    def close(self):
+        self.stopped.set()
+
+        with self.lock:
+            self.flush()
+            self.closeFile()
+
+    def __init__(self, fileName, header, maximumRows=100, maximumSeconds=10):
+        self.fileName = fileName
+        self.header = header
+        self.maximumRows = maximumRows
+        self.maximumSeconds = maximumSeconds
+        self.rows = []
+        self.lastFlush = time.time()
+        self.lock = threading.RLock()
+        self.stopped = threading.Event()
+
+        if maximumSeconds > 0:
+            threading.Thread(target=self.flushRegularly, daemon=True).start()
+
+class CsvSink(ResultSink):
+    def writeRows(self, rows):
+        self.writer.writerows(rows)
+        self.file.flush()
+
+    def closeFile(self):
+        self.file.close()
+
+    def __init__(self, fileName, header, maximumRows=100, maximumSeconds=10):
+        super().__init__(fileName, header, maximumRows, maximumSeconds)
+
+        isNew = not os.path.exists(fileName)
+
+        # results from earlier runs are kept
+        self.file = io.open(fileName, 'a', newline='\n', encoding='utf-8')
+        self.writer = csv.writer(self.file, delimiter=',')
+
+        if isNew:
+            self.writer.writerow(header)
+
+class JsonLinesSink(ResultSink):
+    def writeRows(self, rows):
+        lines = [json.dumps(dict(zip(self.header, row))) for row in rows]
+
+        self.file.write('\n'.join(lines) + '\n')
+        self.file.flush()
+
+    def closeFile(self):
+        self.file.close()
+
+    def __init__(self, fileName, header, maximumRows=100, maximumSeconds=10):
+        super().__init__(fileName, header, maximumRows, maximumSeconds)
+
+        self.file = io.open(fileName, 'a', encoding='utf-8')
+
+class ParquetSink(ResultSink):
+    def writeRows(self, rows):
+        import pyarrow as pa
+
+        columns = list(zip(*rows))
+
+        arrays = []
+
+        for field, column in zip(self.schema, columns):
+            if pa.types.is_integer(field.type):
+                arrays.append(pa.array([int(value) for value in column], type=field.type))
+            else:
+                arrays.append(pa.array([str(value) for value in column], type=field.type))
+
+        # each flush is one row group
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def closeFile(self):
+        self.writer.close()
+
+        # only now does the new file take the old one's place
+        os.replace(self.temporaryFileName, self.fileName)
+
+    def __init__(self, fileName, header, maximumRows=100, maximumSeconds=10):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        super().__init__(fileName, header, maximumRows, maximumSeconds)
+
+        # the confidence is a number. everything else is text.
+        fields = [pa.field(name, pa.string()) for name in header[0:-1]]
+        fields.append(pa.field(header[-1], pa.int64()))
+
+        self.schema = pa.schema(fields)
+
+        existing = None
+
+        # parquet files can't be appended to, so start the new file with what the old one had
+        if os.path.exists(fileName):
+            existing = pq.read_table(fileName).cast(self.schema)
+
+        # the old file stays as it is until the new one is complete. if the script is stopped before that, --combine writes it again from the database.
+        self.temporaryFileName = fileName + '.tmp'
+
+        self.writer = pq.ParquetWriter(self.temporaryFileName, self.schema)
+
+        if existing is not None:
+            self.writer.write_table(existing)
+
+formats = {
+    'csv': CsvSink,
+    'jsonl': JsonLinesSink,
+    'parquet': ParquetSink
+}
+
+def getFileName(fileName, outputFormat):
+    # output.csv becomes output.jsonl and so on
+    base, extension = os.path.splitext(fileName)
+
+    if extension.lower() == '.csv' and outputFormat != 'csv':
+        return base + '.' + outputFormat
+
+    return fileName
+
+def getSink(fileName, outputFormat, header, maximumRows=100, maximumSeconds=10):
+    outputFormat = outputFormat.lower()
+
+    if not outputFormat in formats:
+        logging.error(f'Unknown output format {outputFormat}. Using csv.')
+        outputFormat = 'csv'
+
+    return formats[outputFormat](getFileName(fileName, outputFormat), header, maximumRows, maximumSeconds)
@@ -0,0 +1,122 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+# one aiohttp session per event loop. sessions can't be shared between loops.
+asyncSessions = {}
+
+async def getAsyncSession():
+    import asyncio
+    import aiohttp
+
+    loop = asyncio.get_running_loop()
+
+    session = asyncSessions.get(loop)
+
+    if not session or session.closed:
+        logging.debug('Creating new asynchronous session')
+
+        # keeps idle connections open as long as the blocking pool does
+        connector = aiohttp.TCPConnector(keepalive_timeout=pool.idleSeconds)
+
+        session = aiohttp.ClientSession(connector=connector)
+        asyncSessions[loop] = session
+
+    return session
+
+async def closeAsyncSessions():
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+
+    session = asyncSessions.pop(loop, None)
+
+    if session and not session.closed:
+        await session.close()
+
+def getProxyForUrl(url, proxies):
+    if not proxies:
+        return None
+
+    # same rules as the requests library. use the proxy for the url's scheme.
+    if url.startswith('https:'):
+        return proxies.get('https', None)
+
+    return proxies.get('http', None)
+
+class SessionPool:
+    def get(self, proxies, url):
+        import requests
+
+        key = (getProxyForUrl(url, proxies), self.getHost(url))
+
+        with self.lock:
+            self.evictIdle()
+
+            session = self.sessions.pop(key, None)
+
+            if not session:
+                logging.debug(f'Creating new session for {key[1]}')
+                session = requests.Session()
+
+            # most recently used goes at the end
+            self.sessions[key] = session
+            self.lastUsed[key] = time.time()
+
+            while len(self.sessions) > self.maximumSessions:
+                oldestKey = next(iter(self.sessions))
+                self.close(oldestKey)
+
+        return session
+
+    def keepOnly(self, proxyList):
+        with self.lock:
+            for key in list(self.sessions.keys()):
+                if key[0] and not key[0] in proxyList:
+                    self.close(key)
+
+    def evictIdle(self):
+        now = time.time()
+
+        for key in list(self.sessions.keys()):
+            if now - self.lastUsed.get(key, 0) > self.idleSeconds:
+                self.close(key)
+
+    def close(self, key):
+        session = self.sessions.pop(key, None)
+        self.lastUsed.pop(key, None)
+
+        if not session:
+            return
+
+        try:
+            session.close()
+        except Exception as e:
+            logging.debug(e)
+
+    def closeAll(self):
+        with self.lock:
+            for key in list(self.sessions.keys()):
+                self.close(key)
+
+    def getHost(self, url):
+        from urllib.parse import urlparse
+
+        return urlparse(url).netloc.lower()
+
+    def configure(self, maximumSessions, idleSeconds):
+        if maximumSessions:
+            self.maximumSessions = int(maximumSessions)
+
+        if idleSeconds:
+            self.idleSeconds = int(idleSeconds)
+
+    def __init__(self):
+        self.sessions = OrderedDict()
+        self.lastUsed = {}
+        self.lock = threading.Lock()
+        self.maximumSessions = 100
+        self.idleSeconds = 60
+
+pool = SessionPool()
@@ -0,0 +1,215 @@
+import sqlite3
+import logging
+import os
+import socket
+import time
+
+# items are claimed in batches with a lease. a worker that stops or crashes loses its lease and other workers take over its items.
+class WorkQueue:
+    # items is a list of (id, row in the input file, position in the order to do them in).
+    # fingerprint identifies this version of the input file. when it's the one the queue was made from, nothing is done.
+    def add(self, items, fingerprint):
+        def addRows():
+            # another worker might have done it already
+            row = self.connection.execute('select fingerprint from queueSources where source = ?', (self.source,)).fetchone()
+
+            if row and row[0] == fingerprint:
+                return False
+
+            # rows that aren't in the new version are removed at the end
+            self.connection.execute('update queue set row = -1 where source = ?', (self.source,))
+
+            rows = ((self.source, id, row, position) for id, row, position in items)
+
+            # an item that's already there keeps its state but moves to its new row
+            self.connection.executemany("""insert into queue (source, id, row, position, state, attempts, worker, leaseUntil) values (?, ?, ?, ?, 'pending', 0, null, 0)
+                on conflict(source, id) do update set row = excluded.row, position = excluded.position""", rows)
+
+            self.connection.execute('delete from queue where source = ? and row = -1', (self.source,))
+            self.connection.execute('insert or replace into queueSources (source, fingerprint) values (?, ?)', (self.source, fingerprint))
+
+            return True
+
+        return self.runInTransaction(addRows)
+
+    def isCurrent(self, fingerprint):
+        row = self.connection.execute('select fingerprint from queueSources where source = ?', (self.source,)).fetchone()
+
+        return row is not None and row[0] == fingerprint
+
+    def resetDeleted(self):
+        def resetRows():
+            # results that were deleted since the last run need to be found again.
+            # recently finished ones might still be waiting to be written by another worker.
+            self.connection.execute("update queue set state = 'pending' where source = ? and state = 'done' and leaseUntil < ? and not id in (select id from history)", (self.source, time.time() - 60))
+
+        self.runInTransaction(resetRows)
+
+    def claim(self, count):
+        def claimRows():
+            now = time.time()
+
+            rows = self.connection.execute("select id, row from queue where source = ? and state = 'pending' and leaseUntil < ? order by position limit ?", (self.source, now, count)).fetchall()
+
+            self.connection.executemany('update queue set worker = ?, leaseUntil = ? where source = ? and id = ?', [(self.worker, now + self.leaseSeconds, self.source, row[0]) for row in rows])
+
+            return rows
+
+        rows = self.runInTransaction(claimRows)
+
+        if rows:
+            logging.debug(f'Claimed {len(rows)} items')
+
+        for id, row in rows:
+            self.held[id] = True
+
+        self.lastRenewed = time.time()
+
+        return rows
+
+    def renewIfNeeded(self):
+        # renew well before the lease runs out
+        if time.time() - self.lastRenewed < self.leaseSeconds / 3:
+            return
+
+        self.renew()
+
+    def renew(self):
+        if not self.held:
+            return
+
+        now = time.time()
+
+        def renewRows():
+            self.connection.executemany("update queue set leaseUntil = ? where source = ? and id = ? and worker = ? and state = 'pending'", [(now + self.leaseSeconds, self.source, id, self.worker) for id in self.held])
+
+        self.runInTransaction(renewRows)
+
+        self.lastRenewed = now
+
+    def finish(self, id):
+        self.held.pop(id, None)
+
+        def finishRow():
+            self.connection.execute("update queue set state = 'done', worker = null, leaseUntil = ? where source = ? and id = ?", (time.time(), self.source, id))
+
+        self.runInTransaction(finishRow)
+
+    # gives it back without counting it as a failed try
+    def release(self, id):
+        self.held.pop(id, None)
+
+        def releaseRow():
+            self.connection.execute("update queue set worker = null, leaseUntil = 0 where source = ? and id = ? and state = 'pending'", (self.source, id))
+
+        self.runInTransaction(releaseRow)
+
+    def releaseAll(self):
+        for id in list(self.held.keys()):
+            self.release(id)
+
+    # waits longer after each failed try. after too many it's parked and not tried again.
+    # giveUp parks it right away, for failures that would happen again.
+    def retryLater(self, id, giveUp=False):
+        self.held.pop(id, None)
+
+        def retryRow():
+            row = self.connection.execute('select attempts from queue where source = ? and id = ?', (self.source, id)).fetchone()
+
+            if not row:
+                return
+
+            attempts = (row[0] or 0) + 1
+
+            if giveUp or attempts >= self.maximumAttempts:
+                logging.info(f'Giving up on {id} after {attempts} tries')
+
+                self.connection.execute("update queue set state = 'parked', attempts = ?, worker = null where source = ? and id = ? and state = 'pending'", (attempts, self.source, id))
+                return
+
+            seconds = min(self.retrySeconds * 2 ** (attempts - 1), self.retryMaximumSeconds)
+
+            logging.debug(f'Will try {id} again in {seconds} seconds')
+
+            # so it's not tried again right away, by this worker or another one
+            self.connection.execute("update queue set attempts = ?, worker = null, leaseUntil = ? where source = ? and id = ? and state = 'pending'", (attempts, time.time() + seconds, self.source, id))
+
+        self.runInTransaction(retryRow)
+
+    def unpark(self):
+        def unparkRows():
+            self.connection.execute("update queue set state = 'pending', attempts = 0, leaseUntil = 0 where source = ? and state = 'parked'", (self.source,))
+
+        self.runInTransaction(unparkRows)
+
+    def getCounts(self):
+        row = self.connection.execute("select count(*), sum(case when state = 'done' then 1 else 0 end), sum(case when state = 'parked' then 1 else 0 end) from queue where source = ?", (self.source,)).fetchone()
+
+        return row[1] or 0, row[2] or 0, row[0] or 0
+
+    def getPendingCount(self):
+        row = self.connection.execute("select count(*) from queue where source = ? and state = 'pending'", (self.source,)).fetchone()
+
+        return row[0] or 0
+
+    def getParkedIds(self):
+        return [row[0] for row in self.connection.execute("select id from queue where source = ? and state = 'parked'", (self.source,))]
+
+    def getSecondsUntilNextItem(self):
+        row = self.connection.execute("select min(leaseUntil) from queue where source = ? and state = 'pending'", (self.source,)).fetchone()
+
+        if row[0] is None:
+            return 0
+
+        return max(row[0] - time.time(), 0)
+
+    def configureRetries(self, maximumAttempts, retrySeconds, retryMaximumSeconds):
+        self.maximumAttempts = int(maximumAttempts)
+        self.retrySeconds = int(retrySeconds)
+        self.retryMaximumSeconds = int(retryMaximumSeconds)
+
+    def runInTransaction(self, function):
+        # immediate so two workers can't claim the same items
+        self.connection.execute('begin immediate')
+
+        try:
+            result = function()
+            self.connection.execute('commit')
+        except Exception:
+            self.connection.execute('rollback')
+            raise
+
+        return result
+
+    def open(self, fileName):
+        # manages its own transactions
+        # the async engine uses it from another thread
+        self.connection = sqlite3.connect(fileName, timeout=60, isolation_level=None, check_same_thread=False)
+        self.connection.execute('pragma journal_mode=wal')
+        self.connection.execute('create table if not exists queue ( source text, id text, row integer, position integer, state text, attempts integer, worker text, leaseUntil real, primary key(source, id) )')
+        self.connection.execute('create index if not exists queueClaim on queue (source, state, position)')
+        # which version of each input file the queue was made from
+        self.connection.execute('create table if not exists queueSources ( source text, fingerprint text, primary key(source) )')
+
+    def close(self):
+        if not self.connection:
+            return
+
+        self.releaseAll()
+
+        self.connection.close()
+        self.connection = None
+
+    def __init__(self, fileName, source, leaseSeconds=300):
+        # several input files can share a database
+        self.source = os.path.abspath(source)
+        self.worker = f'{socket.gethostname()}-{os.getpid()}'
+        self.leaseSeconds = leaseSeconds
+        self.held = {}
+        self.lastRenewed = 0
+        self.maximumAttempts = 5
+        self.retrySeconds = 10
+        self.retryMaximumSeconds = 600
+        self.connection = None
+
+        self.open(fileName)
@@ -2,4 +2,4 @@ start python main.py --threadNumber 1 --threadCount 4
 start python main.py --threadNumber 2 --threadCount 4
 start python main.py --threadNumber 3 --threadCount 4
 start python main.py --threadNumber 4 --threadCount 4
-start python main.py --combine
\ No newline at end of file
+start python main.py --combine --wait
\ No newline at end of file